@@ -0,0 +1,118 @@
+"""Automatic lane, hit line and note color calibration from a short burst of frames"""
+
+import time
+
+import cv2
+import numpy as np
+
+from calibration import hsv_range
+
+
+def grab_burst(sct, region, count=8, interval=0.02):
+    """Grab `count` frames of a screen region about `interval` seconds apart"""
+    frames = np.empty((count, region["height"], region["width"], 4), dtype=np.uint8)
+    for i in range(count):
+        frames[i] = np.frombuffer(sct.grab(region).raw, dtype=np.uint8).reshape(frames.shape[1:])
+        if i + 1 < count:
+            time.sleep(interval)
+    return frames
+
+
+def moving_pixels(frames, threshold=40, min_value=60):
+    """Bright pixels that changed since the previous frame, i.e. scrolling notes"""
+    gray = np.stack([cv2.cvtColor(frame, cv2.COLOR_BGRA2GRAY) for frame in frames])
+    changed = np.abs(np.diff(gray.astype(np.int16), axis=0)) > threshold
+    return changed & (gray[1:] >= min_value)
+
+
+def dominant_color(frames, moving):
+    """Median HSV of the most common coarse HSV bin among moving pixels"""
+    pixels = frames[1:][moving][:, :3]
+    if len(pixels) == 0:
+        return None
+    hsv = cv2.cvtColor(pixels.reshape(-1, 1, 3), cv2.COLOR_BGR2HSV).reshape(-1, 3).astype(np.int32)
+    bins = (hsv[:, 0] // 10) * 64 + (hsv[:, 1] // 32) * 8 + hsv[:, 2] // 32
+    peak = np.bincount(bins).argmax()
+    h, s, v = np.median(hsv[bins == peak], axis=0).astype(int)
+    return int(h), int(s), int(v)
+
+
+def horizontal_runs(mask):
+    """(start x, width) of every horizontal run of True in a (..., W) mask"""
+    width = mask.shape[-1] + 2
+    padded = np.zeros(mask.shape[:-1] + (width,), dtype=np.int8)
+    padded[..., 1:-1] = mask
+    edges = np.diff(padded, axis=-1)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return starts % (width - 1), ends - starts
+
+
+def lane_geometry(note_mask, lanes, window_width, min_run=6):
+    """Stage (left, lane_width) from the widths and positions of the notes seen"""
+    starts, widths = horizontal_runs(note_mask)
+    keep = widths >= min_run
+    starts, widths = starts[keep], widths[keep]
+    if len(widths) == 0:
+        return None
+    note_width = int(np.median(widths))
+    # Notes sit on a lane grid: pick the pitch that best explains their starts
+    offsets = np.unique(starts) - starts.min()
+    candidates = np.arange(note_width, int(note_width * 1.6) + 1)
+    remainders = offsets[None, :] % candidates[:, None]
+    residual = np.minimum(remainders, candidates[:, None] - remainders).sum(axis=1)
+    lane_width = int(candidates[residual.argmin()])
+    seen_left = int(starts.min()) - (lane_width - note_width) // 2
+    seen_right = int((starts + widths).max())
+    # Lanes without notes in the burst are unknown, so place the stage on the
+    # lane grid of the notes that were seen, as close to centered as possible
+    stage = lanes * lane_width
+    centered = (window_width - stage) // 2
+    lefts = [seen_left - k * lane_width for k in range(lanes) if seen_left - k * lane_width + stage >= seen_right]
+    if not lefts:
+        return max(0, seen_left), lane_width
+    return max(0, min(lefts, key=lambda left: abs(left - centered))), lane_width
+
+
+def hit_line_row(frames, note_mask, left, right):
+    """Row of the judgement line: the brightest static row below the notes, else where notes end"""
+    rows = np.flatnonzero(note_mask[..., left:right].any(axis=(0, 2)))
+    notes_end = int(rows[-1]) if len(rows) else frames.shape[1] - 1
+    static = np.median(frames[:, :, left:right, :3], axis=0).mean(axis=(1, 2))
+    search = static[notes_end - 40:notes_end + 40] if notes_end >= 40 else static[:notes_end + 40]
+    offset = max(0, notes_end - 40)
+    if len(search) and search.max() > np.median(static) + 40:
+        return offset + int(search.argmax())
+    return notes_end
+
+
+def auto_calibrate(frames, lanes, roi_height=300):
+    """Find the hit zone ROI (relative to the frames) and the note HSV range
+
+    Returns a dict with roi (x1, y1, width, height), lower_color, upper_color,
+    picked (h, s, v), lane_width and hit_line, or None when no moving notes
+    were found in the burst.
+    """
+    moving = moving_pixels(frames)
+    picked = dominant_color(frames, moving)
+    if picked is None:
+        return None
+    lower_color, upper_color = hsv_range(*picked)
+    note_mask = np.stack([
+        cv2.inRange(cv2.cvtColor(frame, cv2.COLOR_BGR2HSV), lower_color, upper_color) > 0 for frame in frames
+    ])
+    geometry = lane_geometry(note_mask, lanes, frames.shape[2])
+    if geometry is None:
+        return None
+    left, lane_width = geometry
+    right = min(frames.shape[2], left + lanes * lane_width)
+    hit_line = hit_line_row(frames, note_mask, left, right)
+    top = max(0, hit_line - roi_height)
+    return {
+        "roi": {"x1": left, "y1": top, "width": right - left, "height": hit_line + 1 - top},
+        "lower_color": lower_color,
+        "upper_color": upper_color,
+        "picked": picked,
+        "lane_width": lane_width,
+        "hit_line": hit_line,
+    }
@@ -0,0 +1,452 @@
+"""Offline benchmarks for the detection pipeline (no osu! window needed)"""
+
+import argparse
+import collections
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from bot import Bot, configure
+from capture import FileSource, make_source
+from charts import ChartSource, JUDGEMENTS, error_histogram, judge, load_chart, random_chart
+from calibration import hsv_range
+from classifier import ColorLUT, HSVClassifier
+from config import CAPTURE_BACKEND, COLOR_LUT_BITS, FUSED_KERNEL, KEYS, PREDICTIVE_MODE, PROBE_ROW_STRIDE, SPARSE_PROBE
+from tracing import HOLDER, PRESS, EventTrace, convert_trace, load_trace
+from viewer import DebugViewer
+from replay import NOTE_BGR, FakeController, note_color_range, replay, synthetic_session
+
+# Hit zone ROI sizes (width, height) a 4K playfield column typically gives
+ROI_SIZES = {
+    "1080p": (540, 1080),
+    "1440p": (720, 1440),
+}
+
+
+def synthetic_roi(width, height, lanes=4, seed=0):
+    """Dark playfield with lane dividers, a few notes and some noise"""
+    rng = np.random.default_rng(seed)
+    img = np.zeros((height, width, 4), dtype=np.uint8)
+    img[..., 3] = 255
+    lane_width = width // lanes
+    img[:, ::lane_width, :3] = 200
+    for i in range(lanes):
+        y = rng.integers(0, height - 40)
+        img[y:y + 40, i * lane_width + 4:(i + 1) * lane_width - 4, :3] = NOTE_BGR
+    img[..., :3] += rng.integers(0, 8, (height, width, 3), dtype=np.uint8)
+    return img
+
+
+class LimitedSource:
+    """Stops a live source after `count` frames"""
+
+    def __init__(self, source, count):
+        self.source = source
+        self.count = count
+        self.shape = source.shape
+
+    def open(self):
+        self.remaining = self.count
+        self.source.open()
+
+    def read_into(self, out):
+        if self.remaining == 0:
+            return None
+        self.remaining -= 1
+        return self.source.read_into(out)
+
+    def close(self):
+        self.source.close()
+
+
+def time_calls(fn, repeat):
+    samples = np.empty(repeat)
+    for n in range(repeat):
+        start = time.perf_counter_ns()
+        fn()
+        samples[n] = time.perf_counter_ns() - start
+    return samples / 1000
+
+
+def bench_classify(repeat):
+    lower_color, upper_color = note_color_range()
+
+    start = time.perf_counter()
+    lut = ColorLUT(lower_color, upper_color, bits=COLOR_LUT_BITS)
+    print(f"LUT build: {(time.perf_counter() - start) * 1000:.1f}ms, {lut.table.nbytes / 1024:.0f} KiB ({COLOR_LUT_BITS} bits)")
+
+    print(f"{'ROI':>7} {'size':>10} {'path':>16} {'p50 us':>9} {'p99 us':>9} {'agree':>8} {'missed':>13}")
+    for name, (width, height) in ROI_SIZES.items():
+        img = synthetic_roi(width, height)
+        reference = cv2.inRange(cv2.cvtColor(img, cv2.COLOR_BGR2HSV), lower_color, upper_color)
+        out = np.empty(img.shape[:2], dtype=np.uint8)
+        hsv = HSVClassifier(lower_color, upper_color)
+        paths = {
+            "cvtColor+inRange": lambda: cv2.inRange(cv2.cvtColor(img, cv2.COLOR_BGR2HSV), lower_color, upper_color),
+            "lut": lambda: lut.classify(img, out=out),
+            "HSVClassifier": lambda: hsv.classify(img, out=out),
+        }
+        for label, fn in paths.items():
+            samples = time_calls(fn, repeat)
+            found = fn() > 0
+            agree = (found == (reference > 0)).mean() * 100
+            missed = f"{np.count_nonzero((reference > 0) & ~found)}/{np.count_nonzero(reference)}"
+            print(f"{name:>7} {width:>4}x{height:<5} {label:>16} {np.percentile(samples, 50):9.1f} {np.percentile(samples, 99):9.1f} {agree:7.3f}% {missed:>13}")
+
+
+def bench_probe(frames, lower_color, upper_color, strides=(4, 8, 16)):
+    """Check sparse probing against the full mask frame by frame, and time both
+
+    Agreement is the share of frames where the hit band detection (occupied,
+    bottom) and the look-ahead notes (found, bottom, top) match the full path.
+    """
+    height, width = frames.shape[1:3]
+    keyboard = FakeController(clock=time.perf_counter_ns)
+    print(f"{len(frames)} frames of {width}x{height}")
+    print(f"{'path':>10} {'band agree':>11} {'ahead agree':>12} {'p50 us':>9} {'p99 us':>9}")
+    reference = None
+    try:
+        for stride in (None,) + tuple(strides):
+            configure(SPARSE_PROBE=stride is not None, PROBE_ROW_STRIDE=stride or PROBE_ROW_STRIDE)
+            configure(PREDICTIVE_MODE=False)
+            band_bot = Bot(width, height, lower_color, upper_color, keyboard)
+            configure(PREDICTIVE_MODE=True)
+            ahead_bot = Bot(width, height, lower_color, upper_color, keyboard)
+            hit_line = ahead_bot.predictor.hit_line
+            results = []
+            samples = np.empty(len(frames))
+            for n, img in enumerate(frames):
+                start = time.perf_counter_ns()
+                band = band_bot.detector.detect(band_bot.label(img), band_bot.probe_lanes)
+                samples[n] = time.perf_counter_ns() - start
+                rows = ahead_bot.detector.lane_rows(ahead_bot.label(img), ahead_bot.probe_lanes)
+                ahead = ahead_bot.detector.next_notes(rows, hit_line)
+                results.append((band, ahead))
+            if reference is None:
+                reference = results
+            band_agree = np.mean([all((a == b).all() for a, b in zip(r[0], f[0])) for r, f in zip(reference, results)])
+            ahead_agree = np.mean([all((a == b)[r[1][0]].all() for a, b in zip(r[1], f[1]))
+                                   for r, f in zip(reference, results)])
+            us = samples / 1000
+            label = "full" if stride is None else f"stride {stride}"
+            print(f"{label:>10} {band_agree * 100:10.2f}% {ahead_agree * 100:11.2f}% "
+                  f"{np.percentile(us, 50):9.1f} {np.percentile(us, 99):9.1f}")
+    finally:
+        configure(SPARSE_PROBE=SPARSE_PROBE, PROBE_ROW_STRIDE=PROBE_ROW_STRIDE, PREDICTIVE_MODE=PREDICTIVE_MODE)
+
+
+def steady_state_allocations(bot, frames, warm_up=50):
+    """Peak and leftover traced bytes while `bot` processes frames after a warm-up, and the NumPy data among them
+
+    The last is what NumPy's tracemalloc domain holds at the end: array data
+    allocated during the loop and still alive. The rest are Python objects.
+    """
+    for n in range(warm_up):
+        bot.process(frames[n % len(frames)], n)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        for n, img in enumerate(frames):
+            bot.process(img, warm_up + n)
+        current, peak = tracemalloc.get_traced_memory()
+        arrays = tracemalloc.take_snapshot().filter_traces([tracemalloc.DomainFilter(True, np.lib.tracemalloc_domain)])
+    finally:
+        tracemalloc.stop()
+    return peak - before, current - before, sum(stat.size for stat in arrays.statistics("filename"))
+
+
+def bench_kernel(frames, lower_color, upper_color, budget=4096):
+    """Check the fused hit band kernel against the full mask, then its allocations with tracemalloc
+
+    Returns False when a frame disagrees, the steady-state loop keeps any
+    NumPy array data, or its Python objects peak above `budget` bytes (a
+    band mask alone is far larger, so no temporary array fits either).
+    """
+    height, width = frames.shape[1:3]
+    keyboard = FakeController()
+    try:
+        configure(FUSED_KERNEL=False, SPARSE_PROBE=False, PREDICTIVE_MODE=False)
+        full = Bot(width, height, lower_color, upper_color, keyboard)
+        configure(FUSED_KERNEL=True)
+        fused = Bot(width, height, lower_color, upper_color, keyboard)
+        agree = 0
+        for img in frames:
+            expected = full.detector.detect(full.mask(full.convert(img)))
+            fused.mask(fused.convert(img))
+            agree += (expected[0] == fused.kernel.occupied).all() and (expected[1] == fused.kernel.bottom).all()
+        print(f"{len(frames)} frames of {width}x{height}: fused kernel agrees with the full mask on {agree} frames")
+
+        ok = agree == len(frames)
+        print(f"{'path':>6} {'p50 us':>9} {'peak bytes':>11} {'left bytes':>11} {'numpy bytes':>12}")
+        for label, bot in (("full", full), ("fused", fused)):
+            samples = time_calls(lambda: bot.mask(bot.convert(frames[len(frames) // 2])), 200)
+            peak, left, arrays = steady_state_allocations(bot, frames)
+            print(f"{label:>6} {np.percentile(samples, 50):9.1f} {peak:11d} {left:11d} {arrays:12d}")
+            if bot is fused and (arrays or peak > budget):
+                ok = False
+        print("OK" if ok else f"FAILED (no NumPy data, Python objects within {budget} bytes)")
+        return ok
+    finally:
+        configure(FUSED_KERNEL=FUSED_KERNEL, SPARSE_PROBE=SPARSE_PROBE, PREDICTIVE_MODE=PREDICTIVE_MODE)
+
+
+def bench_trace(notes, info, repeat=20000, budget=1000):
+    """Time trace record writes, then replay a chart with tracing on and check what a dump holds
+
+    Returns False when a record costs `budget` ns or more, or a dump does not
+    hold exactly the frames and key events the bot produced.
+    """
+    lanes = info["keys"]
+    keys = KEYS if len(KEYS) == lanes else [str(lane) for lane in range(lanes)]
+    trace = EventTrace(4096, lanes)
+    occupied = np.arange(lanes) % 2 == 0
+    bottom = np.where(occupied, 120, -1)
+    now = time.perf_counter_ns()
+    ok = True
+    for label, write in (("frame", lambda: trace.frame(now, occupied, bottom)),
+                         ("key", lambda: trace.key(now, PRESS, 1, HOLDER, 1500))):
+        # Best of a few rounds, the cost itself is steady but this box may not be
+        rounds = []
+        for _ in range(20):
+            start = time.perf_counter_ns()
+            for _ in range(repeat):
+                write()
+            rounds.append((time.perf_counter_ns() - start) / repeat)
+        print(f"{label:>6} record: {min(rounds):.0f} ns ({trace.record_size} bytes)")
+        ok &= min(rounds) < budget
+
+    source = ChartSource(notes, lanes)
+    lower_color, upper_color = note_color_range()
+    try:
+        for predictive in (False, True):
+            configure(KEYS=keys, PREDICTIVE_MODE=predictive)
+            # Whole run in one ring, then the same run in a ring that wraps many times
+            for capacity in (len(source) * 2, 1024):
+                trace = EventTrace(capacity, lanes)
+                keyboard = replay(source, lower_color, upper_color, trace=trace)
+                with tempfile.TemporaryDirectory() as directory:
+                    path = os.path.join(directory, "trace.bin")
+                    trace.dump(path)
+                    records, _ = load_trace(path)
+                    output, _ = convert_trace(path)
+                    with open(output) as f:
+                        chrome_events = len(json.load(f)["traceEvents"])
+                first = min(record[0] for record in records)
+                traced = collections.Counter((record[0], keys[record[4]], "press" if record[2] == PRESS else "release")
+                                             for record in records if record[5] is None)
+                sent = collections.Counter(event for event in keyboard.events if event[0] >= first)
+                frames = sum(record[5] is not None for record in records)
+                if capacity > len(source) + len(keyboard.events):
+                    expected = len(source)
+                    # Everything but the releases of release_all() at the end
+                    untraced = sent - traced
+                    match = not traced - sent and all(action == "release" for _, _, action in untraced)
+                else:
+                    expected = capacity - 1 - sum(traced.values())
+                    # The oldest kept key events may share a timestamp with dropped ones
+                    match = not traced - sent
+                print(f"{'predictive' if predictive else 'reactive':>10} ring of {capacity}: {len(records)} records, "
+                      f"{frames} frames, {sum(traced.values())} key events ({'match' if match else 'MISMATCH'}), "
+                      f"{chrome_events} Chrome trace events")
+                ok &= match and frames == expected
+    finally:
+        configure(KEYS=KEYS, PREDICTIVE_MODE=PREDICTIVE_MODE)
+    print("OK" if ok else f"FAILED (budget {budget} ns per record)")
+    return ok
+
+
+def bench_pipeline(source, lower_color, upper_color, output=None, viewer_fps=0):
+    """Time every stage of Bot.process for each frame of `source`
+
+    With viewer_fps, frames are also published for the debug viewer (without
+    opening its window) and the "viewer" stage shows what that costs the loop.
+    """
+    height, width = source.shape[:2]
+    bot = Bot(width, height, lower_color, upper_color, FakeController(clock=time.perf_counter_ns))
+    img = np.empty(source.shape, dtype=np.uint8)
+    stages = ("grab", "conversion", "mask", "decision", "dispatch")
+    viewer = None
+    if viewer_fps:
+        stages += ("viewer",)
+        viewer = DebugViewer(source.shape, bot.lanes, bot.detector.lane_width, height - 1,
+                             bot.detector.band_start, viewer_fps)
+    samples = {stage: [] for stage in stages}
+    clock = time.perf_counter_ns
+
+    source.open()
+    try:
+        start = clock()
+        while True:
+            t0 = clock()
+            timestamp = source.read_into(img)
+            if timestamp is None:
+                break
+            t1 = clock()
+            index = bot.convert(img)
+            t2 = clock()
+            color_mask = bot.mask(index)
+            t3 = clock()
+            press, release = bot.decide(color_mask, t0)
+            t4 = clock()
+            bot.dispatch(press, release, t0)
+            t5 = clock()
+            if viewer is not None:
+                viewer.publish(img, t0, bot)
+            t6 = clock()
+            for stage, begin, end in zip(stages, (t0, t1, t2, t3, t4, t5), (t1, t2, t3, t4, t5, t6)):
+                samples[stage].append(end - begin)
+        elapsed = clock() - start
+    finally:
+        source.close()
+        if viewer is not None:
+            viewer.close()
+
+    frames = len(samples["grab"])
+    totals = np.sum([samples[stage] for stage in stages], axis=0) / 1000
+    results = {"frames": frames, "fps": frames / (elapsed / 1e9), "stages": {}}
+    print(f"{frames} frames of {width}x{height}, {results['fps']:.0f} fps")
+    print(f"{'stage':>10} {'p50 us':>9} {'p99 us':>9}")
+    for stage in stages:
+        us = np.array(samples[stage]) / 1000
+        results["stages"][stage] = {"p50_us": np.percentile(us, 50), "p99_us": np.percentile(us, 99)}
+        print(f"{stage:>10} {np.percentile(us, 50):9.1f} {np.percentile(us, 99):9.1f}")
+    results["stages"]["total"] = {"p50_us": np.percentile(totals, 50), "p99_us": np.percentile(totals, 99)}
+    print(f"{'total':>10} {np.percentile(totals, 50):9.1f} {np.percentile(totals, 99):9.1f}")
+    if viewer is not None:
+        overhead = np.sum(samples["viewer"]) / (np.sum(totals) * 1000 - np.sum(samples["viewer"])) * 100
+        results["viewer_overhead_pct"] = overhead
+        print(f"Viewer publishing at {viewer_fps} fps costs {overhead:.2f}% of loop time")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {output}")
+    return results
+
+
+def bench_chart(notes, info, fps=240, speed=1.5, color=NOTE_BGR, output=None, latency=0):
+    """Play a chart from rendered frames with a fake keyboard and grade it with osu!mania hit windows
+
+    `latency` ms of input and display delay is simulated by grading every key
+    event that much later than the bot sent it.
+    """
+    lanes = info["keys"]
+    keys = KEYS if len(KEYS) == lanes else [str(lane) for lane in range(lanes)]
+    source = ChartSource(notes, lanes, fps=fps, speed=speed, color=color)
+    lower_color, upper_color = note_color_range(color)
+    configure(KEYS=keys)
+    try:
+        start = time.perf_counter_ns()
+        keyboard = replay(source, lower_color, upper_color)
+        elapsed = time.perf_counter_ns() - start
+    finally:
+        configure(KEYS=KEYS)
+    result = judge(notes, keyboard.events, keys, info["od"], source.origin + latency)
+
+    frames = len(source)
+    results = {
+        "chart": info["title"], "notes": len(notes), "frames": frames, "latency": latency,
+        "fps": frames / (elapsed / 1e9), "bot_fps": frames / ((elapsed - source.render_ns) / 1e9),
+        "accuracy": result["accuracy"], "extra_presses": result["extra_presses"],
+        "press": dict(result["press"]), "release": dict(result["release"]), "errors_ms": {},
+    }
+    print(f"{info['title']}: {len(notes)} notes, {lanes}K, OD {info['od']:g}, {frames} frames at {fps} fps, "
+          f"{speed} px/ms, {latency:g}ms simulated latency")
+    print(f"Throughput {results['fps']:.0f} fps with rendering, {results['bot_fps']:.0f} fps for the bot alone")
+    print(f"Accuracy {result['accuracy'] * 100:.2f}%, {result['extra_presses']} extra presses")
+    for kind, label in (("press", "presses"), ("release", "releases")):
+        counts = " ".join(f"{name}:{result[kind][name]}" for name in JUDGEMENTS)
+        errors = np.array(result[f"{kind}_errors"])
+        if len(errors):
+            results["errors_ms"][kind] = {"mean": errors.mean(), "std": errors.std(),
+                                          "p50_abs": np.percentile(np.abs(errors), 50),
+                                          "p99_abs": np.percentile(np.abs(errors), 99)}
+            print(f"{label:>8} {counts} | error mean {errors.mean():+.1f}ms sd {errors.std():.1f}ms "
+                  f"|p99| {np.percentile(np.abs(errors), 99):.1f}ms")
+            for line in error_histogram(errors):
+                print(f"          {line}")
+        else:
+            print(f"{label:>8} {counts}")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {output}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("bench", choices=["classify", "pipeline", "probe", "chart", "kernel", "trace"], help="which benchmark to run")
+    parser.add_argument("--repeat", type=int, default=200, help="timed iterations per case")
+    parser.add_argument("--frames", help=".npy/.npz frames for the pipeline benchmark (default: synthetic)")
+    parser.add_argument("--hsv", type=int, nargs=3, metavar=("H", "S", "V"), help="note color of --frames")
+    parser.add_argument("--live", type=int, nargs=4, metavar=("LEFT", "TOP", "WIDTH", "HEIGHT"),
+                        help="grab this screen region live (CAPTURE_BACKEND) instead of replaying frames")
+    parser.add_argument("--output", help="write pipeline results as JSON for commit-to-commit comparison")
+    parser.add_argument("--strides", type=int, nargs="+", default=[4, 8, 16],
+                        help="probe row strides to check against the full mask")
+    parser.add_argument("--chart", help=".osu beatmap or simple chart for the chart benchmark (default: random)")
+    parser.add_argument("--fps", type=int, default=240, help="frame rate the chart is rendered at")
+    parser.add_argument("--speed", type=float, default=1.5, help="scroll speed of the rendered chart in px/ms")
+    parser.add_argument("--color", type=int, nargs=3, metavar=("B", "G", "R"), default=NOTE_BGR,
+                        help="note color of the rendered chart")
+    parser.add_argument("--predictive", action="store_true", help="play the chart with PREDICTIVE_MODE on")
+    parser.add_argument("--latency", type=float, default=0, metavar="MS",
+                        help="simulated key press to screen round trip the chart is graded with")
+    parser.add_argument("--offset", type=float, metavar="MS",
+                        help="INPUT_LATENCY the bot compensates with (default: config)")
+    parser.add_argument("--viewer", type=int, default=0, metavar="FPS",
+                        help="also publish frames for the debug viewer at this rate and report its cost")
+    args = parser.parse_args()
+
+    if args.bench == "classify":
+        bench_classify(args.repeat)
+    elif args.bench == "pipeline":
+        lower_color, upper_color = note_color_range()
+        if args.hsv:
+            lower_color, upper_color = hsv_range(*args.hsv)
+        if args.live:
+            left, top, width, height = args.live
+            source = LimitedSource(make_source({"left": left, "top": top, "width": width, "height": height},
+                                               CAPTURE_BACKEND), args.repeat)
+        elif args.frames:
+            source = FileSource(args.frames, realtime=False)
+        else:
+            frames, timestamps, _ = synthetic_session(count=max(args.repeat, 600))
+            source = FileSource(frames, timestamps, realtime=False)
+        bench_pipeline(source, lower_color, upper_color, args.output, args.viewer)
+    elif args.bench in ("probe", "kernel"):
+        lower_color, upper_color = note_color_range()
+        if args.hsv:
+            lower_color, upper_color = hsv_range(*args.hsv)
+        if args.frames:
+            frames = FileSource(args.frames, realtime=False).frames
+        else:
+            frames, _, _ = synthetic_session(count=max(args.repeat, 600))
+        if args.bench == "probe":
+            bench_probe(frames, lower_color, upper_color, args.strides)
+        elif not bench_kernel(frames, lower_color, upper_color):
+            sys.exit(1)
+    elif args.bench == "trace":
+        notes, info = load_chart(args.chart) if args.chart else random_chart(duration=10000)
+        if not bench_trace(notes, info):
+            sys.exit(1)
+    elif args.bench == "chart":
+        notes, info = load_chart(args.chart) if args.chart else random_chart()
+        if args.predictive:
+            configure(PREDICTIVE_MODE=True)
+        if args.offset is not None:
+            configure(INPUT_LATENCY=args.offset)
+        bench_chart(notes, info, args.fps, args.speed, tuple(args.color), args.output, args.latency)
+
+
+if __name__ == "__main__":
+    main()
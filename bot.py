@@ -1,86 +1,330 @@
 """Core bot logic for real-time note detection and key automation"""
 
-import mss
-import numpy as np
-import cv2
+import os
 import time
-from pynput.keyboard import Controller
 
+import numpy as np
+
+from capture import CaptureThread, FrameRing, detection_region, make_source
+from classifier import ColorLUT, HSVClassifier
+from dispatch import KeyDispatcher, make_backend
+from instrumentation import Instrumentation, clock
+from lanes import HitBandKernel, LaneDetector, LaneState, SparseProbe, lane_class_masks
+from pacing import FramePacer, idle_rate
+from predictive import PredictiveLanes
+from recording import SessionRecorder
+from scheduler import PressScheduler
+from tracing import HOLDER, PRESS, RELEASE, TAP, EventTrace, convert_trace, hotkey_listener
+from viewer import DebugViewer
 from config import *
 
 
-def run_bot(hit_zone, lower_color, upper_color):
-    lane_width = hit_zone["width"] // 4
-    key_pressed = [False] * 4
-    note_press_time = [0] * 4
-    is_holder = [False] * 4
-    last_color_seen_time = [0] * 4
-    holder_tail_bottom = [0] * 4
-    
-    keyboard = Controller()
+class Bot:
+    """Frame to key press pipeline shared by live play and offline replay
+
+    lower_color/upper_color hold one HSV range or one per color class;
+    class_lanes optionally lists, per class, the lanes it applies to.
+    With a `trace` (EventTrace) every frame's lane detections and every key
+    decision are recorded into it.
+    """
+
+    def __init__(self, width, height, lower_color, upper_color, keyboard, stats=None, dispatcher=None,
+                 class_lanes=None, trace=None):
+        self.lanes = len(KEYS)
+        self.keyboard = keyboard
+        self.stats = stats
+        self.dispatcher = dispatcher
+        self.trace = trace
+        self.lut = ColorLUT(lower_color, upper_color, bits=COLOR_LUT_BITS)
+        lane_classes = lane_class_masks(class_lanes, self.lanes) if class_lanes else None
+        self.detector = LaneDetector(width, height, self.lanes, HIT_ZONE_SIZE, lane_classes)
+        self.state = LaneState(self.lanes, KEY_HOLD_TIME, HOLDER_THRESHOLD, HOLDER_TAIL_GONE_TIME)
+        self.color_mask = np.empty((height, width), dtype=np.uint8)
+        self.scheduler = None
+        self.predictor = None
+        if PREDICTIVE_MODE:
+            self.scheduler = PressScheduler(keyboard, KEYS, spin_ns=int(SCHEDULER_SPIN * 1e6), trace=trace,
+                                            stats=stats)
+            self.predictor = PredictiveLanes(self.lanes, height - 1 - HIT_LINE_OFFSET, self.scheduler,
+                                             KEY_HOLD_TIME, HOLDER_THRESHOLD, HOLDER_TAIL_GONE_TIME,
+                                             SCROLL_SPEED_SMOOTHING, PREDICT_REPRESS_GUARD, INPUT_LATENCY)
+            self._no_keys = np.zeros(self.lanes, dtype=bool)
+        self.probe = None
+        self.probe_lanes = None
+        if SPARSE_PROBE:
+            # Only lanes the probe fires in are classified, the rest of the mask stays zero
+            self.probe = SparseProbe(self.detector, self.lut, PROBE_ROW_STRIDE, PROBE_COLUMNS)
+            self._sparse_start = 0 if self.predictor is not None else self.detector.band_start
+            self._lane_index = np.empty((height - self._sparse_start, self.detector.lane_width), dtype=np.intp)
+            self._written = np.zeros(self.lanes, dtype=bool)
+            self.color_mask[:] = 0
+        self.kernel = None
+        if FUSED_KERNEL and self.predictor is None and self.probe is None:
+            # Reactive mode only needs the hit band: classify and reduce it in preallocated buffers
+            self.color_mask[:] = 0
+            self.kernel = HitBandKernel(self.detector, self.lut, self.color_mask)
+        # Whole frames are classified faster by OpenCV than through the table
+        self.classifier = HSVClassifier(lower_color, upper_color) if self.kernel is None else self.lut
+        # First color_mask row the chosen path writes, the rows above it stay zero
+        self.mask_start = 0
+        if self.kernel is not None:
+            self.mask_start = self.detector.band_start
+        elif self.probe is not None:
+            self.mask_start = self._sparse_start
+
+    def convert(self, img):
+        if self.kernel is not None:
+            return self.kernel.index(img)
+        return self.classifier.index(img)
+
+    def mask(self, index):
+        if self.kernel is not None:
+            return self.kernel.reduce(index)
+        return self.classifier.lookup(index, self.color_mask)
+
+    def hot_lanes(self, img):
+        """Lane indices the sparse probe found color in (anywhere for predictive mode, else the hit band)"""
+        band = self.probe.probe(img)
+        self.probe_lanes = np.flatnonzero(self.probe.lookahead if self.predictor is not None else band)
+        return self.probe_lanes
+
+    def sparse_mask(self, img, lanes):
+        """Classify only the given lanes into color_mask, clearing lanes labeled on the previous frame"""
+        start = self._sparse_start
+        width = self.detector.lane_width
+        stale = self._written.copy()
+        stale[lanes] = False
+        for lane in np.flatnonzero(stale):
+            self.color_mask[start:, lane * width:(lane + 1) * width] = 0
+        for lane in lanes:
+            columns = slice(lane * width, (lane + 1) * width)
+            index = self.lut.index(img[start:, columns], out=self._lane_index)
+            self.lut.lookup(index, self.color_mask[start:, columns])
+        self._written[:] = False
+        self._written[lanes] = True
+        return self.color_mask
+
+    def label(self, img):
+        if self.probe is not None:
+            return self.sparse_mask(img, self.hot_lanes(img))
+        return self.mask(self.convert(img))
+
+    def has_color(self):
+        """Whether the last frame showed note color anywhere in the ROI"""
+        if self.probe is not None:
+            return bool(self.probe.lookahead.any())
+        if self.kernel is not None:
+            return self.kernel.ahead or bool(self.kernel.occupied.any())
+        # Notes are taller than 8 px, so every 8th row is enough to tell an empty screen
+        return bool(self.color_mask[::8].any())
+
+    def decide(self, color_mask, timestamp):
+        if self.predictor is not None:
+            # Key events go through the scheduler, nothing to dispatch from this frame
+            rows = self.detector.lane_rows(color_mask, self.probe_lanes)
+            found, bottom, top = self.detector.next_notes(rows, self.predictor.hit_line)
+            occupied = rows[self.detector.band_start:].any(axis=0)
+            held_top = self.detector.held_tops(rows, self.predictor.hit_line)
+            self.predictor.update(timestamp, found, bottom, top, occupied, held_top)
+            if self.trace is not None:
+                self.trace.frame(timestamp, found, bottom)
+            return self._no_keys, self._no_keys
+        if self.kernel is not None:
+            occupied, bottom = self.kernel.occupied, self.kernel.bottom
+        else:
+            occupied, bottom = self.detector.detect(color_mask, self.probe_lanes)
+        press, release = self.state.update(timestamp / 1e6, occupied, bottom)
+        if self.trace is not None:
+            self.trace.frame(timestamp, occupied, bottom)
+            if press.any() or release.any():
+                self.trace_keys(timestamp, press, release)
+        return press, release
+
+    def trace_keys(self, timestamp, press, release):
+        """Record this frame's reactive key decisions, released holders apart from taps"""
+        delay = clock() - timestamp
+        for lane in np.flatnonzero(press).tolist():
+            self.trace.key(timestamp, PRESS, lane, TAP, delay)
+        for lane in np.flatnonzero(release).tolist():
+            self.trace.key(timestamp, RELEASE, lane, HOLDER if self.state.released_holder[lane] else TAP, delay)
+
+    def dispatch(self, press, release, timestamp):
+        if self.dispatcher is not None:
+            if press.any() or release.any():
+                self.dispatcher.submit(np.flatnonzero(press).tolist(), np.flatnonzero(release).tolist(), timestamp)
+            return
+        if press.any():
+            for i in np.flatnonzero(press):
+                self.keyboard.press(KEYS[i])
+                if self.stats is not None:
+                    self.stats.end_to_end.record(clock() - timestamp)
+        if release.any():
+            for i in np.flatnonzero(release):
+                self.keyboard.release(KEYS[i])
+
+    def process(self, img, timestamp):
+        """Run one frame captured at `timestamp` (perf_counter_ns) through every stage"""
+        stats = self.stats
+        if stats is None:
+            press, release = self.decide(self.label(img), timestamp)
+            self.dispatch(press, release, timestamp)
+            return
+        t0 = clock()
+        color_mask = self.label(img)
+        t1 = clock()
+        press, release = self.decide(color_mask, timestamp)
+        t2 = clock()
+        self.dispatch(press, release, timestamp)
+        t3 = clock()
+        stats.classify.record(t1 - t0)
+        stats.decision.record(t2 - t1)
+        stats.dispatch.record(t3 - t2)
+        stats.frame_done(t3)
+
+    def warm_up(self, rounds=3):
+        """Run the detection kernels on blank frames so first-call costs are paid before play"""
+        img = np.zeros(self.color_mask.shape + (4,), dtype=np.uint8)
+        for _ in range(rounds):
+            color_mask = self.mask(self.convert(img))
+            if self.probe is not None:
+                color_mask = self.sparse_mask(img, np.arange(self.lanes))
+                self.sparse_mask(img, self.hot_lanes(img))
+            self.detector.detect(color_mask)
+            rows = self.detector.lane_rows(color_mask)
+            self.detector.next_notes(rows, self.detector.height - 1)
+
+    def keys_down(self):
+        """Lanes whose key is currently held down"""
+        if self.predictor is None:
+            return self.state.pressed
+        down = np.zeros(self.lanes, dtype=bool)
+        for lane in range(self.lanes):
+            press = self.predictor.pending_press[lane]
+            release = self.predictor.pending_release[lane]
+            if press is not None and press.fired:
+                down[lane] = self.predictor.holding[lane] or (release is not None and not release.fired)
+        return down
+
+    def release_all(self):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        for key in KEYS:
+            self.keyboard.release(key)
+
+
+def configure(**settings):
+    """Override config values the bot runs with, e.g. timings loaded from a profile"""
+    for name, value in settings.items():
+        if not name.isupper() or name not in globals():
+            raise KeyError(f"Unknown setting {name}")
+        globals()[name] = value
+
+
+def dump_trace(trace, dumps):
+    """Write the trace ring to a new .bin file and add its path to `dumps`"""
+    path = time.strftime(f"{TRACE_PATH}-%Y%m%d-%H%M%S") + f"-{len(dumps) + 1}.bin"
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    count = trace.dump(path)
+    dumps.append(path)
+    print(f"Trace of the last {count} records written to {path}")
+
+
+def run_bot(hit_zone, lower_color, upper_color, source=None, keyboard=None, class_lanes=None):
+    """Play with the color classes given by lower_color/upper_color, see Bot for class_lanes"""
+    if keyboard is None:
+        keyboard = make_backend(KEY_BACKEND, KEYS)
+    stats = Instrumentation(STATS_SUMMARY_INTERVAL) if INSTRUMENT else None
+    dispatcher = KeyDispatcher(keyboard, KEYS, stats) if ASYNC_DISPATCH else None
+    if source is None:
+        # Only the hit band and the look-ahead above it are grabbed
+        rows = None if CAPTURE_LOOKAHEAD is None else HIT_ZONE_SIZE + CAPTURE_LOOKAHEAD
+        region = detection_region(hit_zone, rows)
+        source = make_source(region, CAPTURE_BACKEND)
+        print(f"Capturing {region['width']}x{region['height']} with {type(source).__name__}")
+    height, width = source.shape[:2]
+    trace = EventTrace(TRACE_RECORDS, len(KEYS)) if TRACE_RECORDS else None
+    bot = Bot(width, height, lower_color, upper_color, keyboard, stats, dispatcher, class_lanes, trace)
+    bot.warm_up()
     
-    print(f"\nACTIVE BOT MODE (Tap + Holder Support)")
+    print(f"\nACTIVE BOT MODE (Tap + Holder Support, {bot.lanes}K)")
     print(f"HOLDER_THRESHOLD={HOLDER_THRESHOLD}ms, HOLDER_TAIL_GONE_TIME={HOLDER_TAIL_GONE_TIME}ms")
     print("Press Ctrl+C to stop.")
     
-    with mss.mss() as sct:
+    buffers = None
+    if hasattr(source, "frame_buffers"):
         try:
-            while True:
-                current_time = time.time() * 1000
-                img = np.array(sct.grab(hit_zone))
-                hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-                color_mask = cv2.inRange(hsv, lower_color, upper_color)
-                
-                for i in range(4):
-                    x_start = i * lane_width
-                    x_end = (i + 1) * lane_width
-                    
-                    lane_mask = color_mask[:, x_start:x_end]
-                    hit_zone_start = max(0, hit_zone["height"] - HIT_ZONE_SIZE)
-                    hit_zone_mask = lane_mask[hit_zone_start:, :]
-                    
-                    note_detected = np.any(hit_zone_mask)
-                    
-                    if note_detected:
-                        last_color_seen_time[i] = current_time
-                        
-                        colored_rows = np.where(np.any(hit_zone_mask, axis=1))[0]
-                        if len(colored_rows) > 0:
-                            holder_tail_bottom[i] = hit_zone_start + colored_rows[-1]
-                        
-                        if not key_pressed[i]:
-                            keyboard.press(KEYS[i])
-                            key_pressed[i] = True
-                            note_press_time[i] = current_time
-                            is_holder[i] = False
-                        else:
-                            time_held = current_time - note_press_time[i]
-                            if time_held > HOLDER_THRESHOLD:
-                                is_holder[i] = True
-                    else:
-                        if key_pressed[i]:
-                            time_since_last_color = current_time - last_color_seen_time[i]
-                            
-                            if is_holder[i]:
-                                if time_since_last_color > HOLDER_TAIL_GONE_TIME:
-                                    keyboard.release(KEYS[i])
-                                    key_pressed[i] = False
-                                    is_holder[i] = False
-                            else:
-                                if time_since_last_color > KEY_HOLD_TIME:
-                                    keyboard.release(KEYS[i])
-                                    key_pressed[i] = False
-                
-                if SHOW_DEBUG:
-                    display_view = img.copy()
-                    cv2.line(display_view, (0, hit_zone["height"]-5), (hit_zone["width"], hit_zone["height"]-5), (0, 0, 255), 3)
-                    for j in range(1, 4):
-                        cv2.line(display_view, (j * lane_width, 0), (j * lane_width, hit_zone["height"]), (0, 255, 0), 2)
-                    cv2.imshow('Bot Vision', display_view)
-                    if cv2.waitKey(1) & 0xFF == ord('q'):
-                        break
-        except KeyboardInterrupt:
-            print("\nBot stopped.")
-        finally:
-            for i in range(4):
-                keyboard.release(KEYS[i])
+            buffers = source.frame_buffers(CAPTURE_RING_SLOTS)
+        except OSError as error:
+            print(f"Shared-memory frame buffers unavailable ({error}), grabbing through a copy")
+    ring = FrameRing(source.shape, slots=CAPTURE_RING_SLOTS, buffers=buffers)
+    recorder = None
+    if RECORD_DIR:
+        path = os.path.join(RECORD_DIR, time.strftime("session-%Y%m%d-%H%M%S"))
+        meta = {"hit_zone": hit_zone, "rows": height, "lower_color": np.asarray(lower_color).tolist(),
+                "upper_color": np.asarray(upper_color).tolist(), "class_lanes": class_lanes, "keys": KEYS}
+        recorder = SessionRecorder(path, source.shape, meta)
+        print(f"Recording session to {path}")
+    idle_fps = idle_rate(IDLE_FPS, height - HIT_ZONE_SIZE, MAX_SCROLL_SPEED)
+    if idle_fps > IDLE_FPS:
+        print(f"Idle polling raised to {idle_fps:.0f} fps: notes at {MAX_SCROLL_SPEED} px/ms cross the "
+              f"{height - HIT_ZONE_SIZE} look-ahead rows in {(height - HIT_ZONE_SIZE) / MAX_SCROLL_SPEED:.0f}ms")
+    pacer = FramePacer(CAPTURE_FPS, idle_fps, IDLE_AFTER)
+    capture = CaptureThread(source, ring, recorder, stats, pacer)
+    capture.start()
+    if dispatcher is not None:
+        dispatcher.start()
+    if bot.scheduler is not None:
+        bot.scheduler.start()
+        print(f"Predictive mode: presses scheduled for the hit line {HIT_LINE_OFFSET}px above the ROI bottom, "
+              f"{INPUT_LATENCY:g}ms early for input latency")
+    viewer = None
+    if SHOW_DEBUG:
+        viewer = DebugViewer(source.shape, bot.lanes, bot.detector.lane_width, height - 1 - HIT_LINE_OFFSET,
+                             bot.detector.band_start, VIEWER_FPS)
+        viewer.start()
+    listener = None
+    trace_dumps = []
+    if trace is not None and TRACE_HOTKEY:
+        # Runs on the listener thread mid-song: only the binary ring is written, JSON comes at exit
+        listener = hotkey_listener(TRACE_HOTKEY, lambda: dump_trace(trace, trace_dumps))
+        print(f"Press {TRACE_HOTKEY} to dump the last {TRACE_RECORDS} trace records")
+    
+    last_seq = 0
+    interrupted = False
+    try:
+        while True:
+            frame = ring.read_latest(last_seq)
+            if frame is None:
+                break
+            last_seq, img, timestamp = frame
+            bot.process(img, timestamp)
+            pacer.update(bot.has_color(), timestamp)
+            if viewer is not None and viewer.publish(img, timestamp, bot):
+                break
+    except KeyboardInterrupt:
+        print("\nBot stopped.")
+        interrupted = True
+    finally:
+        if listener is not None:
+            listener.stop()
+        capture.stop()
+        capture.join(timeout=1)
+        if dispatcher is not None:
+            dispatcher.stop()
+        bot.release_all()
+        if viewer is not None:
+            viewer.close()
+        print(f"Captured {capture.frames_captured} frames, processed up to #{last_seq}")
+        print(f"Pacing: {pacer.summary_line()}")
+        if stats is not None:
+            print(stats.summary_line())
+            stats.export(STATS_EXPORT)
+            print(f"Latency histograms written to {STATS_EXPORT}")
+        # Keys are up and every thread has stopped, the JSON conversion can take its time
+        if trace is not None and interrupted:
+            dump_trace(trace, trace_dumps)
+        for path in trace_dumps:
+            output, _ = convert_trace(path)
+            print(f"Chrome trace written to {output}")
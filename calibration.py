@@ -4,6 +4,8 @@ import cv2
 import numpy as np
 import time
 
+from config import TOLERANCE_H, TOLERANCE_S, TOLERANCE_V
+
 
 def take_calibration_screenshot(sct, osu_win):
     print("\n=== TAKING SCREENSHOT ===")
@@ -26,33 +28,32 @@ def take_calibration_screenshot(sct, osu_win):
     return img
 
 
-def pick_color(img):
+def pick_colors(img, max_colors=8):
     hsv_img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
     display = img.copy()
-    picked_color = {"h": None, "s": None, "v": None}
+    picks = []
     
     def mouse_callback(event, x, y, flags, param):
-        if event == cv2.EVENT_LBUTTONDOWN:
+        if event == cv2.EVENT_LBUTTONDOWN and len(picks) < max_colors:
             h, s, v = hsv_img[y, x]
-            picked_color["h"] = int(h)
-            picked_color["s"] = int(s)
-            picked_color["v"] = int(v)
-            print(f"Picked color at ({x}, {y}): H={h}, S={s}, V={v}")
+            picks.append({"h": int(h), "s": int(s), "v": int(v), "x": x, "y": y})
+            cv2.circle(display, (x, y), 6, (0, 255, 0), 2)
+            print(f"Picked color {len(picks)} at ({x}, {y}): H={h}, S={s}, V={v}")
     
-    cv2.namedWindow("Color Picker - Click on a note in the screenshot")
-    cv2.setMouseCallback("Color Picker - Click on a note in the screenshot", mouse_callback)
+    cv2.namedWindow("Color Picker - Click a note of each color")
+    cv2.setMouseCallback("Color Picker - Click a note of each color", mouse_callback)
     
-    print("Click on a note in the screenshot to get its exact color")
+    print("Click a note of every color the skin uses, in the lane it appears in")
     print("Press SPACE when done picking")
     
     while True:
-        cv2.imshow("Color Picker - Click on a note in the screenshot", display)
+        cv2.imshow("Color Picker - Click a note of each color", display)
         key = cv2.waitKey(1) & 0xFF
         
         if key == ord(' '):
-            if picked_color["h"] is not None:
+            if picks:
                 cv2.destroyAllWindows()
-                return picked_color
+                return picks
             else:
                 print("No color picked yet")
 
@@ -105,3 +106,39 @@ def select_roi(img):
                 }
         elif key == ord('r'):
             state = {"x1": None, "y1": None, "x2": None, "y2": None, "selecting": False}
+
+
+def hsv_range(h, s, v):
+    lower_color = np.array([max(0, h - TOLERANCE_H), max(0, s - TOLERANCE_S), max(0, v - TOLERANCE_V)])
+    upper_color = np.array([min(180, h + TOLERANCE_H), min(255, s + TOLERANCE_S), min(255, v + TOLERANCE_V)])
+    return lower_color, upper_color
+
+
+def color_classes(picks, roi, lanes):
+    """Group picked colors into HSV classes and the lanes each was picked in
+
+    Picks within the HSV tolerances of each other share a class. A class picked
+    outside the ROI applies to every lane. Returns (lower_color, upper_color,
+    class_lanes) with one row / entry per class.
+    """
+    lane_width = roi["width"] // lanes
+    classes = []
+    for pick in picks:
+        column = pick["x"] - roi["x1"]
+        lane = column // lane_width if 0 <= column < lanes * lane_width else None
+        for color in classes:
+            if (abs(color["h"] - pick["h"]) <= TOLERANCE_H and abs(color["s"] - pick["s"]) <= TOLERANCE_S
+                    and abs(color["v"] - pick["v"]) <= TOLERANCE_V):
+                break
+        else:
+            color = {"h": pick["h"], "s": pick["s"], "v": pick["v"], "lanes": set()}
+            classes.append(color)
+        if lane is None or color["lanes"] is None:
+            color["lanes"] = None
+        else:
+            color["lanes"].add(int(lane))
+    ranges = [hsv_range(color["h"], color["s"], color["v"]) for color in classes]
+    lower_color = np.array([lower for lower, _ in ranges])
+    upper_color = np.array([upper for _, upper in ranges])
+    class_lanes = [None if color["lanes"] is None else sorted(color["lanes"]) for color in classes]
+    return lower_color, upper_color, class_lanes
@@ -0,0 +1,429 @@
+"""Frame sources and the capture thread that feeds the detector"""
+
+import sys
+import threading
+import time
+
+import numpy as np
+
+# X errors recorded by the handler XShmSource installs, Xlib's default handler would exit the process
+_x_errors = []
+_x_error_handler = None
+
+
+class FrameRing:
+    """Fixed ring of preallocated frame buffers, the reader always gets the newest frame"""
+
+    def __init__(self, shape, slots=3, buffers=None):
+        """`buffers` optionally supplies the slot frames, e.g. a source's shared-memory images"""
+        if slots < 3:
+            raise ValueError("FrameRing needs at least 3 slots")
+        self.slots = slots
+        self.frames = buffers if buffers is not None else np.zeros((slots,) + tuple(shape), dtype=np.uint8)
+        self.timestamps = np.zeros(slots, dtype=np.int64)
+        self.seq = 0
+        self.closed = False
+        self._latest = -1
+        self._reading = -1
+        self._next = 0
+        self._cond = threading.Condition()
+
+    def write_slot(self):
+        # Never hand out the slot being read or the newest published one
+        with self._cond:
+            slot = self._next
+            while slot == self._reading or slot == self._latest:
+                slot = (slot + 1) % self.slots
+            self._next = (slot + 1) % self.slots
+        return slot
+
+    def publish(self, slot, timestamp):
+        with self._cond:
+            self.timestamps[slot] = timestamp
+            self._latest = slot
+            self.seq += 1
+            self._cond.notify_all()
+
+    def read_latest(self, last_seq, timeout=None):
+        """Wait for a frame newer than last_seq, returns (seq, frame, timestamp) or None"""
+        with self._cond:
+            if self.seq == last_seq and not self.closed:
+                self._cond.wait_for(lambda: self.seq != last_seq or self.closed, timeout)
+            if self.seq == last_seq:
+                return None
+            self._reading = self._latest
+            return self.seq, self.frames[self._latest], int(self.timestamps[self._latest])
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class MssSource:
+    """Live screen capture of a screen region through mss"""
+
+    def __init__(self, region):
+        self.region = region
+        self.shape = (region["height"], region["width"], 4)
+        self._sct = None
+
+    def open(self):
+        # mss handles are not shareable between threads, so open in the capture thread
+        import mss
+        self._sct = mss.mss()
+
+    def read_into(self, out):
+        timestamp = time.perf_counter_ns()
+        shot = self._sct.grab(self.region)
+        out[...] = np.frombuffer(shot.raw, dtype=np.uint8).reshape(self.shape)
+        return timestamp
+
+    def close(self):
+        if self._sct is not None:
+            self._sct.close()
+            self._sct = None
+
+
+class XShmSource:
+    """Live screen capture on X11 through MIT-SHM, the X server writes straight into our buffers
+
+    Each image lives in a SysV shared memory segment that XShmGetImage fills in
+    place. frame_buffers() hands those images to the FrameRing as its slots, so
+    a grab lands in the ring with no copy at all; reads into any other array
+    grab into a scratch image and copy once. Raises OSError when there is no
+    X display or it lacks MIT-SHM, and when the server rejects a request:
+    an X error handler records the error instead of letting Xlib exit, so a
+    refused XShmAttach (remote X) or a region off the screen can fall back
+    to mss. The display connection is only ever used by one thread at a time
+    (set up first, then the capture thread).
+    """
+
+    def __init__(self, region):
+        self.region = region
+        self.shape = (region["height"], region["width"], 4)
+        self._display = None
+        self._images = {}
+        self._ring_images = set()
+        self._scratch = None
+
+    def _connect(self):
+        if self._display is not None:
+            return
+        import ctypes
+        import ctypes.util
+
+        class XShmSegmentInfo(ctypes.Structure):
+            _fields_ = [("shmseg", ctypes.c_ulong), ("shmid", ctypes.c_int), ("shmaddr", ctypes.c_void_p),
+                        ("readOnly", ctypes.c_int)]
+
+        class XImage(ctypes.Structure):
+            _fields_ = [("width", ctypes.c_int), ("height", ctypes.c_int), ("xoffset", ctypes.c_int),
+                        ("format", ctypes.c_int), ("data", ctypes.c_void_p), ("byte_order", ctypes.c_int),
+                        ("bitmap_unit", ctypes.c_int), ("bitmap_bit_order", ctypes.c_int),
+                        ("bitmap_pad", ctypes.c_int), ("depth", ctypes.c_int), ("bytes_per_line", ctypes.c_int),
+                        ("bits_per_pixel", ctypes.c_int)]
+
+        class XErrorEvent(ctypes.Structure):
+            _fields_ = [("type", ctypes.c_int), ("display", ctypes.c_void_p), ("resourceid", ctypes.c_ulong),
+                        ("serial", ctypes.c_ulong), ("error_code", ctypes.c_ubyte), ("request_code", ctypes.c_ubyte),
+                        ("minor_code", ctypes.c_ubyte)]
+
+        x11_name, xext_name = ctypes.util.find_library("X11"), ctypes.util.find_library("Xext")
+        if not x11_name or not xext_name:
+            raise OSError("libX11/libXext not found")
+        x11 = ctypes.CDLL(x11_name)
+        xext = ctypes.CDLL(xext_name)
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        x11.XDefaultRootWindow.restype = ctypes.c_ulong
+        x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x11.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultVisual.restype = ctypes.c_void_p
+        x11.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XFree.argtypes = [ctypes.c_void_p]
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        x11.XGetErrorText.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+        handler_type = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(XErrorEvent))
+        x11.XSetErrorHandler.argtypes = [handler_type]
+        x11.XSetErrorHandler.restype = ctypes.c_void_p
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                                         ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo), ctypes.c_uint,
+                                         ctypes.c_uint]
+        xext.XShmCreateImage.restype = ctypes.POINTER(XImage)
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(XImage), ctypes.c_int,
+                                      ctypes.c_int, ctypes.c_ulong]
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+        global _x_error_handler
+        if _x_error_handler is None:
+            # Kept referenced for the life of the process, Xlib calls it from any request
+            _x_error_handler = handler_type(lambda _, event: _x_errors.append(event.contents.error_code) or 0)
+            x11.XSetErrorHandler(_x_error_handler)
+
+        display = x11.XOpenDisplay(None)
+        if not display:
+            raise OSError("cannot open X display")
+        if not xext.XShmQueryExtension(display):
+            x11.XCloseDisplay(display)
+            raise OSError("X server has no MIT-SHM extension")
+        screen = x11.XDefaultScreen(display)
+        self._ctypes = ctypes
+        self._x11, self._xext, self._libc = x11, xext, libc
+        self._SegmentInfo = XShmSegmentInfo
+        self._display = display
+        self._root = x11.XDefaultRootWindow(display)
+        self._visual = x11.XDefaultVisual(display, screen)
+        self._depth = x11.XDefaultDepth(display, screen)
+
+    def _create_image(self):
+        """One shared-memory XImage of the region, returns its (H, W, 4) array view"""
+        ctypes = self._ctypes
+        height, width = self.shape[:2]
+        info = self._SegmentInfo()
+        image = self._xext.XShmCreateImage(self._display, self._visual, self._depth, 2, None, ctypes.byref(info),
+                                           width, height)
+        if not image:
+            raise OSError("XShmCreateImage failed")
+        if image.contents.bits_per_pixel != 32 or image.contents.bytes_per_line != width * 4:
+            self._x11.XFree(image)
+            raise OSError("X server image format is not 32-bit BGRX")
+        size = height * width * 4
+        # IPC_PRIVATE, IPC_CREAT | 0600
+        info.shmid = self._libc.shmget(0, size, 0o1000 | 0o600)
+        if info.shmid < 0:
+            self._x11.XFree(image)
+            raise OSError(ctypes.get_errno(), "shmget failed")
+        address = self._libc.shmat(info.shmid, None, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            self._libc.shmctl(info.shmid, 0, None)
+            self._x11.XFree(image)
+            raise OSError(ctypes.get_errno(), "shmat failed")
+        info.shmaddr = image.contents.data = address
+        info.readOnly = 0
+        self._xext.XShmAttach(self._display, ctypes.byref(info))
+        self._x11.XSync(self._display, 0)
+        # IPC_RMID: the segment goes away once both we and the X server detach
+        self._libc.shmctl(info.shmid, 0, None)
+        error = self._x_error()
+        if error:
+            self._libc.shmdt(address)
+            self._x11.XFree(image)
+            raise OSError(f"XShmAttach failed ({error})")
+        view = np.ctypeslib.as_array((ctypes.c_uint8 * size).from_address(address)).reshape(self.shape)
+        self._images[address] = (image, info)
+        return view
+
+    def _x_error(self):
+        """Text of the oldest X error recorded since the last call ("" if none), clears the record"""
+        if not _x_errors:
+            return ""
+        code = _x_errors[0]
+        _x_errors.clear()
+        text = self._ctypes.create_string_buffer(128)
+        self._x11.XGetErrorText(self._display, code, text, len(text))
+        return text.value.decode(errors="replace")
+
+    def check(self):
+        """Grab one frame now, raises OSError if the server won't share memory with us or reach the region"""
+        self._connect()
+        self.read_into(np.empty(self.shape, dtype=np.uint8))
+        self._x11.XSync(self._display, 0)
+        error = self._x_error()
+        if error:
+            raise OSError(f"X error on a trial grab ({error})")
+
+    def frame_buffers(self, slots):
+        """Allocate `slots` shared-memory images for a FrameRing to use as its slots"""
+        self._connect()
+        buffers = [self._create_image() for _ in range(slots)]
+        self._ring_images.update(frame.__array_interface__["data"][0] for frame in buffers)
+        return buffers
+
+    def open(self):
+        self._connect()
+
+    def read_into(self, out):
+        timestamp = time.perf_counter_ns()
+        entry = self._images.get(out.__array_interface__["data"][0])
+        if entry is not None:
+            self._grab(entry[0])
+            return timestamp
+        if self._scratch is None:
+            self._scratch = self._create_image()
+        self._grab(self._images[self._scratch.__array_interface__["data"][0]][0])
+        out[...] = self._scratch
+        return timestamp
+
+    def _grab(self, image):
+        if not self._xext.XShmGetImage(self._display, self._root, image, self.region["left"], self.region["top"],
+                                       0xFFFFFFFF):
+            raise OSError(f"XShmGetImage failed ({self._x_error() or 'no reply'})")
+
+    def close(self):
+        if self._display is None:
+            return
+        self._scratch = None
+        for address, (image, info) in self._images.items():
+            self._xext.XShmDetach(self._display, self._ctypes.byref(info))
+            self._x11.XFree(image)
+            # Ring slots stay mapped (until exit) since the detector may still be reading one
+            if address not in self._ring_images:
+                self._libc.shmdt(address)
+        self._images = {}
+        self._x11.XCloseDisplay(self._display)
+        self._display = None
+
+
+def make_source(region, backend="auto"):
+    """Live capture source by name: "xshm" (X11 MIT-SHM), "mss", or "auto" to try xshm first on Linux
+
+    "auto" only keeps xshm after a trial grab of the region went through.
+    """
+    if backend == "auto":
+        backend = "xshm" if sys.platform.startswith("linux") else "mss"
+        if backend == "xshm":
+            source = XShmSource(region)
+            try:
+                source.check()
+                return source
+            except OSError as error:
+                source.close()
+                print(f"MIT-SHM capture unavailable ({error}), falling back to mss")
+                return MssSource(region)
+    if backend == "xshm":
+        return XShmSource(region)
+    return MssSource(region)
+
+
+def detection_region(hit_zone, rows=None):
+    """The bottom `rows` rows of the hit zone, or all of it when rows is None"""
+    if rows is None or rows >= hit_zone["height"]:
+        return dict(hit_zone)
+    return {"left": hit_zone["left"], "top": hit_zone["top"] + hit_zone["height"] - rows,
+            "width": hit_zone["width"], "height": rows}
+
+
+class FileSource:
+    """Replays frames from a recorded session, a .npy/.npz file or an (N, H, W, 4) array
+
+    With `realtime` it plays like a live screen: a read returns the newest
+    frame due by now (waiting for the next one if none is), skipping frames
+    a slow reader missed, stamped with the time that frame was due.
+    """
+
+    def __init__(self, frames, timestamps=None, fps=60, realtime=True, loop=False):
+        self.meta = {}
+        if isinstance(frames, str):
+            if frames.endswith(".npz"):
+                data = np.load(frames)
+                if timestamps is None and "timestamps" in data:
+                    timestamps = data["timestamps"]
+                frames = data["frames"]
+            elif frames.endswith(".npy"):
+                frames = np.load(frames, mmap_mode="r")
+            else:
+                from recording import SessionReader
+                session = SessionReader(frames)
+                frames, timestamps, self.meta = session.frames, session.timestamps, session.meta
+        self.frames = frames
+        if timestamps is None:
+            timestamps = np.arange(len(frames), dtype=np.int64) * int(1e9 / fps)
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self._offsets = self.timestamps - self.timestamps[0] if len(self.timestamps) else self.timestamps
+        self.shape = frames.shape[1:]
+        self.realtime = realtime
+        self.loop = loop
+        self.index = 0
+        self._start = 0
+
+    def open(self):
+        self.index = 0
+        self._start = time.perf_counter_ns()
+
+    def read(self):
+        """Return (frame view, timestamp) for the next frame without copying, None at the end"""
+        if self.index >= len(self.frames):
+            if not self.loop:
+                return None
+            self.index = 0
+            self._start = time.perf_counter_ns()
+        i = self.index
+        if not self.realtime:
+            self.index += 1
+            return self.frames[i], int(self.timestamps[i])
+        # Latest frame wins, as on a live screen
+        elapsed = time.perf_counter_ns() - self._start
+        i = min(max(i, int(np.searchsorted(self._offsets, elapsed, side="right")) - 1), len(self.frames) - 1)
+        self.index = i + 1
+        due = self._start + int(self._offsets[i])
+        remaining = due - time.perf_counter_ns()
+        if remaining > 2_000_000:
+            time.sleep((remaining - 1_000_000) / 1e9)
+        while time.perf_counter_ns() < due:
+            time.sleep(0)
+        return self.frames[i], due
+
+    def read_into(self, out):
+        frame = self.read()
+        if frame is None:
+            return None
+        out[...] = frame[0]
+        return frame[1]
+
+    def close(self):
+        pass
+
+
+class CaptureThread(threading.Thread):
+    """Producer that keeps grabbing frames from a source into a FrameRing"""
+
+    def __init__(self, source, ring, recorder=None, stats=None, pacer=None):
+        super().__init__(name="capture", daemon=True)
+        self.source = source
+        self.ring = ring
+        self.recorder = recorder
+        self.stats = stats
+        self.pacer = pacer
+        self.frames_captured = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        self.source.open()
+        try:
+            while not self._stop_event.is_set():
+                if self.pacer is not None:
+                    self.pacer.wait()
+                slot = self.ring.write_slot()
+                if self.stats is None:
+                    timestamp = self.source.read_into(self.ring.frames[slot])
+                else:
+                    start = time.perf_counter_ns()
+                    timestamp = self.source.read_into(self.ring.frames[slot])
+                    self.stats.capture.record(time.perf_counter_ns() - start)
+                if timestamp is None:
+                    break
+                self.ring.publish(slot, timestamp)
+                if self.recorder is not None:
+                    self.recorder.append(self.ring.frames[slot], timestamp)
+                self.frames_captured += 1
+        finally:
+            self.source.close()
+            if self.recorder is not None:
+                self.recorder.close()
+            self.ring.close()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.pacer is not None:
+            self.pacer.wake()
@@ -0,0 +1,239 @@
+"""osu!mania charts: .osu and simple chart parsing, synthetic frame rendering and judgement"""
+
+import collections
+import time
+
+import numpy as np
+
+from replay import NOTE_BGR
+
+# One chart note, times in ms; end is None for taps
+Note = collections.namedtuple("Note", "lane time end")
+
+JUDGEMENTS = ("MAX", "300", "200", "100", "50", "miss")
+JUDGEMENT_SCORE = {"MAX": 300, "300": 300, "200": 200, "100": 100, "50": 50, "miss": 0}
+
+
+def parse_osu(path):
+    """Notes and info (keys, od, title) of an osu!mania .osu beatmap"""
+    info = {}
+    notes = []
+    section = None
+    with open(path, encoding="utf-8-sig") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("//"):
+                continue
+            if line.startswith("[") and line.endswith("]"):
+                section = line[1:-1]
+                continue
+            if section in ("General", "Metadata", "Difficulty"):
+                key, _, value = line.partition(":")
+                info[key.strip()] = value.strip()
+            elif section == "HitObjects":
+                if info.get("Mode") != "3":
+                    raise ValueError(f"{path} is not an osu!mania beatmap")
+                keys = int(float(info["CircleSize"]))
+                parts = line.split(",")
+                lane = min(keys - 1, int(parts[0]) * keys // 512)
+                end = int(parts[5].split(":")[0]) if int(parts[3]) & 128 else None
+                notes.append(Note(lane, int(parts[2]), end))
+    notes.sort(key=lambda note: note.time)
+    return notes, {"keys": int(float(info["CircleSize"])), "od": float(info.get("OverallDifficulty", 8)),
+                   "title": f"{info.get('Artist', '')} - {info.get('Title', '')} [{info.get('Version', '')}]"}
+
+
+def parse_spec(path):
+    """Notes and info of a simple chart: "keys: N" / "od: X" headers, then "lane time [end]" lines"""
+    info = {"keys": 4, "od": 8.0, "title": path}
+    notes = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            if ":" in line:
+                key, _, value = line.partition(":")
+                info[key.strip()] = int(value) if key.strip() == "keys" else float(value)
+                continue
+            fields = line.split()
+            notes.append(Note(int(fields[0]), float(fields[1]), float(fields[2]) if len(fields) > 2 else None))
+    notes.sort(key=lambda note: note.time)
+    return notes, info
+
+
+def load_chart(path):
+    return parse_osu(path) if path.endswith(".osu") else parse_spec(path)
+
+
+def random_chart(lanes=4, duration=30000, gap=(120, 600), hold_chance=0.2, hold_length=(150, 800), seed=0):
+    """Random notes and holders in every lane, returns (notes, info) like load_chart"""
+    rng = np.random.default_rng(seed)
+    notes = []
+    for lane in range(lanes):
+        t = rng.uniform(500, 1000)
+        while t < duration:
+            end = None
+            if rng.random() < hold_chance:
+                end = t + rng.uniform(*hold_length)
+            notes.append(Note(lane, round(t), None if end is None else round(end)))
+            t = (end or t) + rng.uniform(*gap)
+    notes.sort(key=lambda note: note.time)
+    return notes, {"keys": lanes, "od": 8.0, "title": f"random {lanes}K seed {seed}"}
+
+
+class ChartSource:
+    """Renders the hit zone of a chart frame by frame, as a source for replay()
+
+    Notes scroll down at `speed` px/ms and a note's bottom edge reaches
+    `hit_line` (default: the bottom row) at its chart time. Taps are
+    `note_height` px tall, holders span from their head to their tail time.
+    Frames are drawn on demand into the caller's buffer, so charts of any
+    length use no memory. Timestamps start at 0 for chart time `origin` ms.
+    """
+
+    def __init__(self, notes, lanes, lane_width=135, height=400, fps=240, speed=1.5, note_height=30,
+                 color=NOTE_BGR, hit_line=None, lead_in=1000):
+        self.lanes = lanes
+        self.lane_width = lane_width
+        self.shape = (height, lanes * lane_width, 4)
+        self.fps = fps
+        self.speed = speed
+        self.note_height = note_height
+        self.hit_line = height - 1 if hit_line is None else hit_line
+        colors = np.asarray(color, dtype=np.uint8).reshape(-1, 3)
+        self.colors = colors[np.arange(lanes) % len(colors)]
+        self.lane = np.array([note.lane for note in notes], dtype=np.int64)
+        self.start = np.array([note.time for note in notes], dtype=np.float64)
+        self.end = np.array([note.time if note.end is None else note.end for note in notes], dtype=np.float64)
+        self.tap = np.array([note.end is None for note in notes], dtype=bool)
+        self.longest = float((self.end - self.start).max()) if len(notes) else 0
+        first = self.start.min() if len(notes) else 0
+        last = self.end.max() if len(notes) else 0
+        self.origin = min(0.0, first - lead_in)
+        self.count = int((last + 500 - self.origin) * fps / 1000) + 1
+        self.render_ns = 0
+        self.index = 0
+        self._blank = np.zeros(self.shape, dtype=np.uint8)
+        self._blank[..., 3] = 255
+
+    def __len__(self):
+        return self.count
+
+    def open(self):
+        self.index = 0
+        self.render_ns = 0
+
+    def read_into(self, out):
+        if self.index >= self.count:
+            return None
+        started = time.perf_counter_ns()
+        timestamp = int(self.index * 1e9 / self.fps)
+        now = self.origin + timestamp / 1e6
+        self.index += 1
+        out[...] = self._blank
+        height = self.shape[0]
+        # Only notes whose head is within a screen above the hit line can be visible
+        first = np.searchsorted(self.start, now - self.longest - height / self.speed)
+        last = np.searchsorted(self.start, now + self.hit_line / self.speed, side="right")
+        for i in range(first, last):
+            bottom = self.hit_line - int(round((self.start[i] - now) * self.speed))
+            if self.tap[i]:
+                top = bottom - self.note_height + 1
+            else:
+                top = self.hit_line - int(round((self.end[i] - now) * self.speed))
+            if bottom < 0 or top >= height:
+                continue
+            x = self.lane[i] * self.lane_width
+            out[max(0, top):min(height, bottom + 1), x + 4:x + self.lane_width - 4, :3] = self.colors[self.lane[i]]
+        self.render_ns += time.perf_counter_ns() - started
+        return timestamp
+
+    def close(self):
+        pass
+
+
+def hit_windows(od):
+    """osu!mania (ScoreV1) hit windows in ms either side of the note for each judgement"""
+    return {"MAX": 16.0, "300": 64 - 3 * od, "200": 97 - 3 * od, "100": 127 - 3 * od, "50": 151 - 3 * od,
+            "miss": 188 - 3 * od}
+
+
+def grade(error, windows, leniency=1.0):
+    for name in JUDGEMENTS:
+        if abs(error) <= windows[name] * leniency:
+            return name
+    return "miss"
+
+
+def judge(notes, events, keys, od=8.0, origin=0.0, release_leniency=1.5):
+    """Grade key events (timestamp ns, key, action) against the chart
+
+    Presses are matched in order to the next note of their lane that is still
+    inside the miss window; earlier unplayed notes are misses and presses with
+    no note in reach are extra presses. The release after a holder's press is
+    graded against its tail with windows `release_leniency` times wider.
+    Event times are ns since chart time `origin` ms. Returns a dict of
+    judgement counts for presses and releases, the signed errors in ms
+    (positive = late), extra presses and accuracy.
+    """
+    windows = hit_windows(od)
+    result = {"press": collections.Counter(), "release": collections.Counter(),
+              "press_errors": [], "release_errors": [], "extra_presses": 0}
+    by_lane = collections.defaultdict(list)
+    for note in notes:
+        by_lane[note.lane].append(note)
+    actions = collections.defaultdict(list)
+    for timestamp, key, action in events:
+        actions[keys.index(key)].append((origin + timestamp / 1e6, action))
+
+    for lane in range(len(keys)):
+        lane_notes = by_lane.get(lane, [])
+        next_note = 0
+        holding = None
+        for t, action in sorted(actions.get(lane, [])):
+            if action == "release":
+                if holding is not None:
+                    error = t - holding.end
+                    result["release"][grade(error, windows, release_leniency)] += 1
+                    result["release_errors"].append(error)
+                    holding = None
+                continue
+            while next_note < len(lane_notes) and lane_notes[next_note].time + windows["miss"] < t:
+                result["press"]["miss"] += 1
+                if lane_notes[next_note].end is not None:
+                    result["release"]["miss"] += 1
+                next_note += 1
+            if next_note < len(lane_notes) and lane_notes[next_note].time - windows["miss"] <= t:
+                note = lane_notes[next_note]
+                error = t - note.time
+                result["press"][grade(error, windows)] += 1
+                result["press_errors"].append(error)
+                if note.end is not None:
+                    holding = note
+                next_note += 1
+            else:
+                result["extra_presses"] += 1
+        if holding is not None:
+            result["release"]["miss"] += 1
+        for note in lane_notes[next_note:]:
+            result["press"]["miss"] += 1
+            if note.end is not None:
+                result["release"]["miss"] += 1
+
+    judged = result["press"] + result["release"]
+    total = sum(judged.values())
+    result["accuracy"] = sum(JUDGEMENT_SCORE[name] * n for name, n in judged.items()) / (300 * total) if total else 0
+    return result
+
+
+def error_histogram(errors, width=5, span=60):
+    """Text histogram of signed errors in `width` ms bins over +-`span` ms"""
+    errors = np.asarray(errors)
+    if not len(errors):
+        return []
+    edges = np.arange(-span, span + width, width)
+    counts, _ = np.histogram(np.clip(errors, -span, span - 1e-9), edges)
+    scale = 50 / max(1, counts.max())
+    return [f"{low:+4.0f}..{low + width:+4.0f}ms {n:6d} {'#' * int(np.ceil(n * scale))}"
+            for low, n in zip(edges[:-1], counts) if n]
@@ -1,11 +1,13 @@
 """Configuration settings for osu!mania auto-bot"""
 
 # Key Input Configuration
-KEYS = ['z', 'x', '.', '/']  # Keys mapped to lanes (left to right)
+KEYS = ['z', 'x', '.', '/']  # Keys mapped to lanes (left to right), one per lane for 4K through 10K
+KEY_BACKEND = "auto"  # "sendinput" (Windows, one call per chord), "pynput", or "auto" to pick SendInput on Windows
+ASYNC_DISPATCH = True  # Send key events from a worker thread so the detection loop never waits on input
 
 # Timing Configuration
-KEY_HOLD_TIME = 0.2  # Milliseconds to hold regular tap notes before releasing
-HOLDER_THRESHOLD = 100  # Milliseconds of continuous color detection to classify as holder note
+KEY_HOLD_TIME = 20  # Milliseconds to hold regular tap notes before releasing
+HOLDER_THRESHOLD = 100  # Notes longer than this many milliseconds are holders (measured length in predictive mode, press time otherwise)
 HOLDER_TAIL_GONE_TIME = 1  # Milliseconds after color disappears to release holder notes
 
 # Detection Configuration
@@ -13,6 +15,45 @@ HIT_ZONE_SIZE = 60  # Pixel height from hit line where notes are detected and pr
 TOLERANCE_H = 5  # HSV Hue tolerance range (+/-) for color matching
 TOLERANCE_S = 30  # HSV Saturation tolerance range (+/-) for color matching
 TOLERANCE_V = 30  # HSV Value/Brightness tolerance range (+/-) for color matching
+COLOR_LUT_BITS = 8  # Bits kept per BGR channel in the hit band / lane lookup table (8 = exact, 16 MiB; 6 = 4 MiB but misses edge shades)
+FUSED_KERNEL = True  # Reactive mode: classify only the hit band and reduce it to lane outputs in preallocated buffers
+SPARSE_PROBE = False  # Sample a sparse grid first and classify only the lanes where it finds color
+PROBE_ROW_STRIDE = 8  # Rows between probe samples, notes shorter than this can be missed by the probe
+PROBE_COLUMNS = 3  # Probe samples across the middle half of each lane
+
+# Predictive Mode Configuration
+PREDICTIVE_MODE = False  # Track notes above the hit zone and press exactly when they reach the hit line
+HIT_LINE_OFFSET = 0  # Pixels above the bottom of the selected ROI where notes are judged
+SCROLL_SPEED_SMOOTHING = 0.2  # Weight of each new scroll speed measurement (0-1)
+PREDICT_REPRESS_GUARD = 40  # Milliseconds after a press during which the same lane is not pressed again
+SCHEDULER_SPIN = 1  # Milliseconds the scheduler spins before each key event, yielding the GIL each turn (0 = sleep only, ~0.1 ms later)
+INPUT_LATENCY = 0  # Milliseconds from a key press to its feedback on screen, key events are scheduled this much earlier (main.py --latency)
+
+# Capture Configuration
+CAPTURE_BACKEND = "auto"  # "xshm" (X11 MIT-SHM, grabs straight into the frame ring), "mss", or "auto" (xshm on Linux)
+CAPTURE_LOOKAHEAD = 150  # Rows above the hit zone that are captured too, None to capture the whole selected ROI
+CAPTURE_RING_SLOTS = 3  # Preallocated frame buffers shared by the capture thread and the detector (min 3)
+CAPTURE_FPS = 240  # Target capture rate while notes are on screen, 0 to grab as fast as possible
+IDLE_FPS = 10  # Capture rate while no note color has been seen (breaks, menus, intros), raised if the look-ahead needs it
+MAX_SCROLL_SPEED = 3  # Fastest scroll speed in px/ms played; idle polls come at least every look-ahead rows / this ms
+IDLE_AFTER = 1000  # Milliseconds without any note color in the ROI before dropping to IDLE_FPS
+RECORD_DIR = None  # Directory to record every captured hit zone frame to (e.g. "sessions"), None to disable
+
+# Profile Configuration
+PROFILE_PATH = "profiles.json"  # Saved calibrations, keyed by skin name and osu! window size (main.py --fast)
+MACHINE_PATH = "machines.json"  # Measured input latency, keyed by machine name (main.py --latency)
+
+# Auto Calibration Configuration (main.py --auto)
+AUTOCAL_FRAMES = 8  # Frames grabbed from the osu! window to find lanes, hit line and note color
+AUTOCAL_INTERVAL = 0.02  # Seconds between those frames
+AUTOCAL_ROI_HEIGHT = 300  # Pixels above the detected hit line included in the hit zone ROI
 
 # Debug Configuration
-SHOW_DEBUG = False  # Display real-time vision window (impacts performance)
+SHOW_DEBUG = False  # Display the vision window (notes, pressed keys, latencies) from a separate viewer process
+VIEWER_FPS = 20  # Maximum refresh rate of the vision window, the bot copies a frame for it at most this often
+INSTRUMENT = False  # Keep per-stage latency histograms (capture, classify, decision, dispatch, end to end)
+STATS_EXPORT = "latency.json"  # Where histograms are written on exit (.json or .csv)
+STATS_SUMMARY_INTERVAL = 0  # Seconds between one-line latency summaries while running, 0 to disable
+TRACE_RECORDS = 65536  # Last frames and key events kept in a fixed-memory binary trace ring (56 bytes each at 4K), 0 to disable
+TRACE_HOTKEY = None  # Key that dumps the trace while the bot runs, e.g. "f8" (Ctrl+C always dumps it), None for no hotkey
+TRACE_PATH = "traces/trace"  # Dumps go to TRACE_PATH-<time>-<n>.bin, converted to .json on exit (chrome://tracing or ui.perfetto.dev)
@@ -0,0 +1,138 @@
+"""Key dispatch worker and keyboard backends"""
+
+import collections
+import queue
+import sys
+import threading
+import time
+
+
+class KeyDispatcher:
+    """Sends each frame's key events from a worker thread, merged into one batch
+
+    The detector only puts (presses, releases, frame timestamp) on a queue and
+    moves on. The worker drains everything waiting, merges it into a single
+    batch (releases first so a jack can re-press in the same batch) and hands
+    it to the backend: in one call if the backend has send_batch, otherwise
+    with press/release calls. A frame touching a lane already in the batch
+    flushes the batch first, so a lane's events are never reordered. Backends are anything with press(key) and
+    release(key), such as pynput's Controller or replay.FakeController.
+    """
+
+    def __init__(self, backend, keys, stats=None, history=4096):
+        self.backend = backend
+        self.keys = keys
+        self.stats = stats
+        self.batches = 0
+        # (frame timestamp, dispatch timestamp, presses, releases) of recent batches
+        self.history = collections.deque(maxlen=history)
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="dispatch", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, presses, releases, timestamp):
+        """Queue lane indices to press and release for the frame captured at `timestamp`"""
+        if presses or releases:
+            self._queue.put((presses, releases, timestamp))
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join(timeout=1)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            presses, releases, timestamp = list(item[0]), list(item[1]), item[2]
+            # Anything else already waiting joins this batch
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._send(presses, releases, timestamp)
+                    return
+                lanes = set(presses).union(releases)
+                if lanes.intersection(item[0]) or lanes.intersection(item[1]):
+                    # A press then release of the same lane would go out release first and stick
+                    self._send(presses, releases, timestamp)
+                    presses, releases, timestamp = list(item[0]), list(item[1]), item[2]
+                    continue
+                presses.extend(item[0])
+                releases.extend(item[1])
+            self._send(presses, releases, timestamp)
+
+    def _send(self, presses, releases, timestamp):
+        press_keys = [self.keys[i] for i in presses]
+        release_keys = [self.keys[i] for i in releases]
+        if hasattr(self.backend, "send_batch"):
+            self.backend.send_batch(press_keys, release_keys)
+        else:
+            for key in release_keys:
+                self.backend.release(key)
+            for key in press_keys:
+                self.backend.press(key)
+        dispatched = time.perf_counter_ns()
+        self.batches += 1
+        self.history.append((timestamp, dispatched, len(press_keys), len(release_keys)))
+        if self.stats is not None and press_keys:
+            self.stats.end_to_end.record(dispatched - timestamp)
+
+
+class SendInputBackend:
+    """Windows SendInput with scan codes, a whole chord goes out in a single call"""
+
+    def __init__(self, keys):
+        import ctypes
+        from ctypes import wintypes
+
+        class KEYBDINPUT(ctypes.Structure):
+            _fields_ = [("wVk", wintypes.WORD), ("wScan", wintypes.WORD), ("dwFlags", wintypes.DWORD),
+                        ("time", wintypes.DWORD), ("dwExtraInfo", ctypes.c_size_t)]
+
+        class MOUSEINPUT(ctypes.Structure):
+            _fields_ = [("dx", wintypes.LONG), ("dy", wintypes.LONG), ("mouseData", wintypes.DWORD),
+                        ("dwFlags", wintypes.DWORD), ("time", wintypes.DWORD), ("dwExtraInfo", ctypes.c_size_t)]
+
+        class INPUTUNION(ctypes.Union):
+            # MOUSEINPUT is the largest member, it sets sizeof(INPUT)
+            _fields_ = [("ki", KEYBDINPUT), ("mi", MOUSEINPUT)]
+
+        class INPUT(ctypes.Structure):
+            _fields_ = [("type", wintypes.DWORD), ("union", INPUTUNION)]
+
+        self._ctypes = ctypes
+        self._INPUT = INPUT
+        self._user32 = ctypes.windll.user32
+        self._down = {}
+        self._up = {}
+        for key in keys:
+            vk = self._user32.VkKeyScanW(ord(key)) & 0xFF
+            scan = self._user32.MapVirtualKeyW(vk, 0)
+            self._down[key] = INPUT(type=1, union=INPUTUNION(ki=KEYBDINPUT(wScan=scan, dwFlags=0x0008)))
+            self._up[key] = INPUT(type=1, union=INPUTUNION(ki=KEYBDINPUT(wScan=scan, dwFlags=0x0008 | 0x0002)))
+
+    def send_batch(self, presses, releases):
+        inputs = [self._up[key] for key in releases] + [self._down[key] for key in presses]
+        array = (self._INPUT * len(inputs))(*inputs)
+        self._user32.SendInput(len(inputs), array, self._ctypes.sizeof(self._INPUT))
+
+    def press(self, key):
+        self.send_batch([key], [])
+
+    def release(self, key):
+        self.send_batch([], [key])
+
+
+def make_backend(name, keys):
+    """Keyboard backend by name: "sendinput", "pynput", or "auto" (SendInput on Windows)"""
+    if name == "auto":
+        name = "sendinput" if sys.platform == "win32" else "pynput"
+    if name == "sendinput":
+        return SendInputBackend(keys)
+    from pynput.keyboard import Controller
+    return Controller()
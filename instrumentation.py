@@ -0,0 +1,120 @@
+"""Per-stage latency histograms on a monotonic nanosecond clock"""
+
+import csv
+import json
+import time
+
+clock = time.perf_counter_ns
+
+STAGES = ("capture", "classify", "decision", "dispatch", "end_to_end")
+
+
+class LatencyHistogram:
+    """Fixed-size log-linear histogram of durations in ns (8 buckets per power of two, ~6% error)"""
+
+    SIZE = 264  # covers up to 2**35 ns (~34 s), larger values land in the last bucket
+
+    def __init__(self):
+        self.counts = [0] * self.SIZE
+
+    def record(self, ns):
+        if ns < 16:
+            self.counts[ns if ns > 0 else 0] += 1
+            return
+        shift = ns.bit_length() - 4
+        index = (shift << 3) + (ns >> shift)
+        self.counts[index if index < self.SIZE else self.SIZE - 1] += 1
+
+    @staticmethod
+    def bucket_bounds(index):
+        if index < 16:
+            return index, index + 1
+        shift = (index >> 3) - 1
+        low = ((index & 7) + 8) << shift
+        return low, low + (1 << shift)
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def percentile(self, p):
+        """Approximate p-th percentile in ns (bucket midpoint), 0 when empty"""
+        target = self.count * p / 100
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                low, high = self.bucket_bounds(index)
+                return (low + high) / 2
+        return 0
+
+    def mean(self):
+        count = self.count
+        if not count:
+            return 0
+        return sum(sum(self.bucket_bounds(i)) / 2 * n for i, n in enumerate(self.counts) if n) / count
+
+    def max(self):
+        for index in range(self.SIZE - 1, -1, -1):
+            if self.counts[index]:
+                return self.bucket_bounds(index)[1]
+        return 0
+
+    def reset(self):
+        self.counts = [0] * self.SIZE
+
+
+class Instrumentation:
+    """One histogram per pipeline stage plus optional periodic one-line summaries"""
+
+    def __init__(self, summary_interval=0):
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self.capture = self.histograms["capture"]
+        self.classify = self.histograms["classify"]
+        self.decision = self.histograms["decision"]
+        self.dispatch = self.histograms["dispatch"]
+        self.end_to_end = self.histograms["end_to_end"]
+        self.frames = 0
+        self.summary_interval = int(summary_interval * 1e9)
+        self._next_summary = clock() + self.summary_interval
+
+    def frame_done(self, now):
+        self.frames += 1
+        if self.summary_interval and now >= self._next_summary:
+            self._next_summary = now + self.summary_interval
+            print(self.summary_line(), flush=True)
+
+    def summary_line(self):
+        parts = [f"{self.frames} frames"]
+        for stage, histogram in self.histograms.items():
+            if histogram.count:
+                parts.append(f"{stage} p50={histogram.percentile(50) / 1000:.0f}us p99={histogram.percentile(99) / 1000:.0f}us")
+        return " | ".join(parts)
+
+    def as_dict(self):
+        stats = {}
+        for stage, histogram in self.histograms.items():
+            stats[stage] = {
+                "count": histogram.count,
+                "mean_us": histogram.mean() / 1000,
+                "p50_us": histogram.percentile(50) / 1000,
+                "p90_us": histogram.percentile(90) / 1000,
+                "p99_us": histogram.percentile(99) / 1000,
+                "max_us": histogram.max() / 1000,
+                "buckets": [[*histogram.bucket_bounds(i), n] for i, n in enumerate(histogram.counts) if n],
+            }
+        return {"frames": self.frames, "stages": stats}
+
+    def export(self, path):
+        """Write the histograms as JSON, or as CSV rows (stage, low_ns, high_ns, count) for .csv paths"""
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["stage", "low_ns", "high_ns", "count"])
+                for stage, histogram in self.histograms.items():
+                    for index, n in enumerate(histogram.counts):
+                        if n:
+                            writer.writerow([stage, *histogram.bucket_bounds(index), n])
+        else:
+            with open(path, "w") as f:
+                json.dump(self.as_dict(), f, indent=2)
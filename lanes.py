@@ -0,0 +1,255 @@
+"""Vectorized lane detection and per-lane key state for any key count"""
+
+import numpy as np
+
+
+class LaneDetector:
+    """Reduces a color label mask to per-lane occupancy and bottom-most colored row
+
+    `lane_classes` optionally gives each lane a bitmask of the color classes
+    that count as a note there; by default any labeled pixel does.
+    """
+
+    def __init__(self, width, height, lanes, hit_zone_size, lane_classes=None):
+        self.lanes = lanes
+        self.lane_width = width // lanes
+        self.height = height
+        self.band_start = max(0, height - hit_zone_size)
+        self.lane_classes = None
+        if lane_classes is not None:
+            self.lane_classes = np.asarray(lane_classes, dtype=np.uint8)[None, :, None]
+        self._row_index = np.arange(height)[:, None]
+
+    def _lane_view(self, color_mask, lanes=None):
+        view = color_mask[:, :self.lanes * self.lane_width].reshape(color_mask.shape[0], self.lanes, self.lane_width)
+        classes = self.lane_classes
+        if lanes is not None:
+            view = view[:, lanes]
+            if classes is not None:
+                classes = classes[:, lanes]
+        if classes is not None:
+            view = view & classes
+        return view
+
+    def detect(self, color_mask, lanes=None):
+        """Return (occupied, bottom) arrays of length lanes, bottom is -1 for empty lanes
+
+        `lanes` limits the search to those lane indices, the others report empty.
+        """
+        rows = self._lane_view(color_mask[self.band_start:], lanes).any(axis=2)
+        found = rows.any(axis=0)
+        last = self.height - 1 - rows[::-1].argmax(axis=0)
+        if lanes is None:
+            last[~found] = -1
+            return found, last
+        occupied = np.zeros(self.lanes, dtype=bool)
+        bottom = np.full(self.lanes, -1, dtype=last.dtype)
+        occupied[lanes] = found
+        bottom[lanes] = np.where(found, last, -1)
+        return occupied, bottom
+
+    def lane_rows(self, color_mask, lanes=None):
+        """(height, lanes) array, True where a lane has color on that row (only `lanes` if given)"""
+        if lanes is None:
+            return self._lane_view(color_mask).any(axis=2)
+        rows = np.zeros((color_mask.shape[0], self.lanes), dtype=bool)
+        rows[:, lanes] = self._lane_view(color_mask, lanes).any(axis=2)
+        return rows
+
+    def next_notes(self, rows, hit_line):
+        """Find the lowest note in each lane whose bottom edge is still above `hit_line`
+
+        Returns (found, bottom, top) arrays; top is 0 when the note runs past the
+        top of the ROI.
+        """
+        # A bottom edge is a colored row with an empty row (or the ROI edge) below it
+        edges = np.empty_like(rows)
+        edges[:-1] = rows[:-1] & ~rows[1:]
+        edges[-1] = rows[-1]
+        above = edges[:hit_line]
+        found = above.any(axis=0)
+        bottom = hit_line - 1 - above[::-1].argmax(axis=0)
+        starts = np.empty_like(rows)
+        starts[0] = rows[0]
+        starts[1:] = rows[1:] & ~rows[:-1]
+        last_start = np.maximum.accumulate(np.where(starts, self._row_index, 0), axis=0)
+        top = last_start[np.maximum(bottom, 0), np.arange(self.lanes)]
+        return found, bottom, top
+
+    def held_tops(self, rows, hit_line):
+        """Top row of the colored run covering `hit_line` in each lane, -1 where that row is empty
+
+        While a holder is held this is its tail; 0 means the tail is still above the ROI.
+        """
+        above = rows[:hit_line + 1][::-1]
+        run = (~above).argmax(axis=0)
+        top = hit_line + 1 - run
+        top[above.all(axis=0)] = 0
+        top[~rows[hit_line]] = -1
+        return top
+
+
+class LaneState:
+    """Key state for every lane in parallel arrays, advanced one frame at a time
+
+    update() works in buffers allocated here; the press/release masks it
+    returns are overwritten by the next call, as is `released_holder`, the
+    released lanes that were holding a holder.
+    """
+
+    def __init__(self, lanes, key_hold_time, holder_threshold, holder_tail_gone_time):
+        self.key_hold_time = key_hold_time
+        self.holder_threshold = holder_threshold
+        self.holder_tail_gone_time = holder_tail_gone_time
+        self.pressed = np.zeros(lanes, dtype=bool)
+        self.is_holder = np.zeros(lanes, dtype=bool)
+        self.press_time = np.zeros(lanes)
+        self.last_seen = np.zeros(lanes)
+        self.press = np.zeros(lanes, dtype=bool)
+        self.release = np.zeros(lanes, dtype=bool)
+        self.released_holder = np.zeros(lanes, dtype=bool)
+        self._flag = np.zeros(lanes, dtype=bool)
+        self._elapsed = np.zeros(lanes)
+        self._timeout = np.zeros(lanes)
+
+    def update(self, now, occupied, bottom):
+        """Advance to time `now` (ms), returns boolean (press, release) lane masks"""
+        press, release, flag, elapsed, timeout = self.press, self.release, self._flag, self._elapsed, self._timeout
+        np.copyto(self.last_seen, now, where=occupied)
+
+        # press = occupied & ~pressed, holders: held longer than the threshold
+        np.logical_not(self.pressed, out=flag)
+        np.logical_and(occupied, flag, out=press)
+        np.subtract(now, self.press_time, out=elapsed)
+        np.greater(elapsed, self.holder_threshold, out=flag)
+        np.logical_and(flag, self.pressed, out=flag)
+        np.logical_and(flag, occupied, out=flag)
+        np.logical_or(self.is_holder, flag, out=self.is_holder)
+        np.copyto(self.press_time, now, where=press)
+        np.copyto(self.is_holder, False, where=press)
+
+        # release = ~occupied & pressed & (time since seen > the tap or holder timeout)
+        np.subtract(now, self.last_seen, out=elapsed)
+        timeout.fill(self.key_hold_time)
+        np.copyto(timeout, self.holder_tail_gone_time, where=self.is_holder)
+        np.greater(elapsed, timeout, out=release)
+        np.logical_and(release, self.pressed, out=release)
+        np.logical_not(occupied, out=flag)
+        np.logical_and(release, flag, out=release)
+
+        np.logical_and(release, self.is_holder, out=self.released_holder)
+        np.logical_or(self.pressed, press, out=self.pressed)
+        np.logical_not(release, out=flag)
+        np.logical_and(self.pressed, flag, out=self.pressed)
+        np.logical_and(self.is_holder, flag, out=self.is_holder)
+        return press, release
+
+
+class HitBandKernel:
+    """Hit band detection from the raw BGRA frame straight to per-lane outputs
+
+    The fused path for reactive mode: only the hit band is classified, into
+    the band rows of `color_mask`, and reduced to `occupied` and `bottom`
+    (-1 for empty lanes) in buffers allocated once here, so a steady-state
+    frame allocates no arrays. Every `ahead_stride`-th row above the band is
+    classified too, and `ahead` tells whether any of it has note color.
+    """
+
+    def __init__(self, detector, lut, color_mask, ahead_stride=8):
+        self.lut = lut
+        self.height = detector.height
+        self.band_start = detector.band_start
+        lanes, lane_width = detector.lanes, detector.lane_width
+        band_rows = self.height - self.band_start
+        width = color_mask.shape[1]
+        self.color_mask = color_mask
+        self.band = color_mask[self.band_start:]
+        self.labels = np.lib.stride_tricks.as_strided(
+            self.band, shape=(band_rows, lanes, lane_width), strides=(self.band.strides[0], lane_width, 1))
+        self.classes = detector.lane_classes
+        self.index_buffer = np.empty((band_rows, width), dtype=np.intp)
+        self.row_max = np.empty((band_rows, lanes), dtype=np.uint8)
+        self.rows = np.empty((band_rows, lanes), dtype=bool)
+        self.occupied = np.zeros(lanes, dtype=bool)
+        self.bottom = np.full(lanes, -1, dtype=np.int64)
+        self._empty = np.empty(lanes, dtype=bool)
+        self._last = np.empty(lanes, dtype=np.intp)
+        self.ahead_rows = slice(0, self.band_start, ahead_stride)
+        ahead_count = len(range(*self.ahead_rows.indices(self.height)))
+        self.ahead_index = np.empty((ahead_count, width), dtype=np.intp)
+        self.ahead_labels = np.empty((ahead_count, width), dtype=np.uint8)
+        self.ahead = False
+
+    def index(self, img):
+        """Quantize the band (and the sampled rows above it) into LUT indices"""
+        if len(self.ahead_index):
+            self.lut.index(img[self.ahead_rows], out=self.ahead_index)
+        return self.lut.index(img[self.band_start:], out=self.index_buffer)
+
+    def reduce(self, index):
+        """Label the band and fill occupied/bottom, returns the color mask"""
+        self.lut.lookup(index, self.band)
+        if self.classes is not None:
+            np.bitwise_and(self.labels, self.classes, out=self.labels)
+        np.maximum.reduce(self.labels, axis=2, out=self.row_max)
+        np.greater(self.row_max, 0, out=self.rows)
+        np.logical_or.reduce(self.rows, axis=0, out=self.occupied)
+        # Bottom-most colored row is the first one from the bottom
+        np.argmax(self.rows[::-1], axis=0, out=self._last)
+        np.subtract(self.height - 1, self._last, out=self.bottom)
+        np.logical_not(self.occupied, out=self._empty)
+        np.copyto(self.bottom, -1, where=self._empty)
+        if len(self.ahead_index):
+            self.lut.lookup(self.ahead_index, self.ahead_labels)
+            self.ahead = bool(self.ahead_labels.max())
+        return self.color_mask
+
+
+class SparseProbe:
+    """Samples a sparse grid of the frame to find the lanes worth a full look
+
+    The grid is every `row_stride`-th row of the ROI (plus the first row of the
+    hit band and the last row) at `columns` points across the middle half of
+    each lane. A note taller than the stride that overlaps a probed region
+    always hits a sampled pixel.
+    """
+
+    def __init__(self, detector, lut, row_stride=8, columns=3):
+        self.detector = detector
+        self.lut = lut
+        height, width = detector.height, detector.lane_width
+        rows = np.unique(np.r_[np.arange(0, height, row_stride), detector.band_start, height - 1])
+        centers = np.arange(detector.lanes) * width + width // 2
+        offsets = np.linspace(-width // 4, width // 4, columns).astype(int) if columns > 1 else np.zeros(1, int)
+        self.rows = rows[:, None]
+        self.columns = (centers[:, None] + offsets[None, :]).ravel()[None, :]
+        self.band = rows >= detector.band_start
+        self.shape = (len(rows), detector.lanes, len(offsets))
+        self.labels = np.empty(self.shape[:1] + (self.columns.shape[1],), dtype=np.uint8)
+        self.lookahead = np.zeros(detector.lanes, dtype=bool)
+
+    def probe(self, img):
+        """Return a boolean lane mask of lanes with color in the hit band; `lookahead` gets any color at all"""
+        hits = self.lut.classify(img[self.rows, self.columns], out=self.labels).reshape(self.shape)
+        if self.detector.lane_classes is not None:
+            hits = hits & self.detector.lane_classes
+        rows = hits.any(axis=2)
+        self.lookahead = rows.any(axis=0)
+        return rows[self.band].any(axis=0)
+
+
+def lane_class_masks(class_lanes, lanes):
+    """Per-lane class bitmasks from each class's lane list (None = every lane)
+
+    Lanes no class was assigned to accept every class. Returns None when every
+    lane accepts every class, which lets detection skip the per-lane filter.
+    """
+    masks = np.zeros(lanes, dtype=np.uint8)
+    for k, assigned in enumerate(class_lanes):
+        for lane in (range(lanes) if assigned is None else assigned):
+            masks[lane] |= 1 << k
+    everything = (1 << len(class_lanes)) - 1
+    masks[masks == 0] = everything
+    if (masks == everything).all():
+        return None
+    return masks
@@ -0,0 +1,52 @@
+"""Input round trip measurement: press a key and time its feedback in the captured region"""
+
+import time
+
+import numpy as np
+
+
+def feedback_level(frame, baseline, columns):
+    """Mean absolute BGR change of the lane columns against the baseline frame"""
+    lane = frame[:, columns, :3].astype(np.int16)
+    return float(np.abs(lane - baseline[:, columns, :3]).mean())
+
+
+def measure_round_trip(source, keyboard, key, columns, trials=15, hold=0.08, gap=0.25, threshold=12, timeout=0.5):
+    """Press `key` `trials` times and time how long the lane takes to light up in `source`
+
+    Each sample is the time from the press call to the capture timestamp of
+    the first frame whose `columns` differ from the frame grabbed just before
+    the press by more than `threshold` levels on average, so it covers the OS
+    input path, the game reacting and rendering, the display and capture.
+    Trials without visible feedback within `timeout` seconds are skipped.
+    Returns the samples in ms.
+    """
+    frame = np.empty(source.shape, dtype=np.uint8)
+    baseline = np.empty(source.shape, dtype=np.uint8)
+    samples = []
+    source.open()
+    try:
+        for _ in range(trials):
+            source.read_into(baseline)
+            pressed_at = time.perf_counter_ns()
+            keyboard.press(key)
+            try:
+                while time.perf_counter_ns() - pressed_at < timeout * 1e9:
+                    timestamp = source.read_into(frame)
+                    if feedback_level(frame, baseline, columns) > threshold:
+                        samples.append((timestamp - pressed_at) / 1e6)
+                        break
+                time.sleep(max(0.0, hold - (time.perf_counter_ns() - pressed_at) / 1e9))
+            finally:
+                keyboard.release(key)
+            time.sleep(gap)
+    finally:
+        source.close()
+    return samples
+
+
+def summarize(samples):
+    """(offset, spread) in ms: the median round trip and its interquartile range"""
+    samples = np.asarray(samples)
+    low, median, high = np.percentile(samples, [25, 50, 75])
+    return float(median), float(high - low)
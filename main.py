@@ -1,66 +1,162 @@
 """osumania Auto-Bot - Main entry point"""
 
-import mss
-import numpy as np
-import cv2
-import pygetwindow as gw
+import argparse
 import time
 
-from calibration import take_calibration_screenshot, pick_color, select_roi
-from bot import run_bot
-from config import TOLERANCE_H, TOLERANCE_S, TOLERANCE_V
+import pygetwindow as gw
+
+from config import (PROFILE_PATH, MACHINE_PATH, KEYS, KEY_BACKEND, KEY_HOLD_TIME, HOLDER_THRESHOLD,
+                    HOLDER_TAIL_GONE_TIME, HIT_ZONE_SIZE, CAPTURE_BACKEND, PREDICTIVE_MODE, AUTOCAL_FRAMES,
+                    AUTOCAL_INTERVAL, AUTOCAL_ROI_HEIGHT)
+from profiles import load_input_latency, load_profile, save_input_latency, save_profile
+
+
+def calibrate(osu_win):
+    # Only the interactive path needs mss and the OpenCV GUI
+    import mss
+    from calibration import take_calibration_screenshot, pick_colors, select_roi, color_classes
+
+    with mss.mss() as sct:
+        # Step 1: Screenshot
+        print("\n=== STEP 1: SCREENSHOT ===")
+        calibration_img = take_calibration_screenshot(sct, osu_win)
+
+    # Step 2: Color calibration
+    print("\n=== STEP 2: COLOR CALIBRATION ===")
+    picks = pick_colors(calibration_img)
+
+    # Step 3: Hit zone selection
+    print("\n=== STEP 3: SELECT HIT ZONE ===")
+    roi = select_roi(calibration_img)
+
+    lower_color, upper_color, class_lanes = color_classes(picks, roi, len(KEYS))
+    for lower, upper, lanes in zip(lower_color, upper_color, class_lanes):
+        print(f"Using HSV range: H({lower[0]}-{upper[0]}), S({lower[1]}-{upper[1]}), V({lower[2]}-{upper[2]}) "
+              f"for {'all lanes' if lanes is None else 'lanes ' + ', '.join(str(lane + 1) for lane in lanes)}")
+    return lower_color, upper_color, roi, class_lanes
+
+
+def auto_calibrate_window(osu_win):
+    import mss
+    from autocal import auto_calibrate, grab_burst
+
+    window_area = {"top": osu_win.top, "left": osu_win.left, "width": osu_win.width, "height": osu_win.height}
+    start = time.perf_counter()
+    with mss.mss() as sct:
+        frames = grab_burst(sct, window_area, count=AUTOCAL_FRAMES, interval=AUTOCAL_INTERVAL)
+    result = auto_calibrate(frames, len(KEYS), roi_height=AUTOCAL_ROI_HEIGHT)
+    if result is None:
+        return None
+    h, s, v = result["picked"]
+    print(f"Auto calibration in {time.perf_counter() - start:.2f}s: note color H={h}, S={s}, V={v}, "
+          f"lane width {result['lane_width']}px, hit line at y={result['hit_line']}")
+    return result["lower_color"], result["upper_color"], result["roi"], None
+
+
+def measure_latency(hit_zone):
+    from capture import detection_region, make_source
+    from dispatch import make_backend
+    from latency import measure_round_trip, summarize
+
+    print("\n=== INPUT LATENCY ===")
+    print(f"Click back into osu and stay where no notes are on screen (lead-in or a break), "
+          f"the bot will tap '{KEYS[0]}' and watch lane 1 light up")
+    for countdown in range(5, 0, -1):
+        print(f"Measuring in {countdown}...", end='\r', flush=True)
+        time.sleep(1)
+    # The key lighting shows up in the hit band
+    source = make_source(detection_region(hit_zone, HIT_ZONE_SIZE), CAPTURE_BACKEND)
+    samples = measure_round_trip(source, make_backend(KEY_BACKEND, KEYS), KEYS[0],
+                                 slice(0, hit_zone["width"] // len(KEYS)))
+    if len(samples) < 5:
+        print(f"Only {len(samples)} presses showed up on screen, make sure osu is focused and the lane lights up")
+        return
+    latency, spread = summarize(samples)
+    save_input_latency(MACHINE_PATH, latency, spread, samples)
+    print(f"Input latency {latency:.1f}ms (IQR {spread:.1f}ms, {len(samples)} presses), saved to {MACHINE_PATH}")
 
 
 def main():
+    parser = argparse.ArgumentParser(description="osu!mania auto-bot")
+    parser.add_argument("--skin", default="default", help="skin name the calibration profile is saved under")
+    parser.add_argument("--fast", action="store_true",
+                        help="start from the saved profile, skipping calibration and countdowns")
+    parser.add_argument("--auto", action="store_true",
+                        help="calibrate from a short burst of frames instead of clicking (with --fast: only without a profile)")
+    parser.add_argument("--latency", action="store_true",
+                        help="measure the key press to screen round trip on this machine, save it and exit")
+    args = parser.parse_args()
+
     windows = gw.getWindowsWithTitle('osu!')
     if not windows:
         print("Can't find game, make sure it is running")
         return
-    
+
     osu_win = windows[0]
-    time.sleep(0.5)
 
-    with mss.mss() as sct:
-        # Step 1: Screenshot
-        print("\n=== STEP 1: SCREENSHOT ===")
-        calibration_img = take_calibration_screenshot(sct, osu_win)
-        
-        # Step 2: Color calibration
-        print("\n=== STEP 2: COLOR CALIBRATION ===")
-        picked = pick_color(calibration_img)
-        h, s, v = picked["h"], picked["s"], picked["v"]
-        print(f"Picked color: H={h}, S={s}, V={v}")
-        
-        lower_color = np.array([max(0, h - TOLERANCE_H), max(0, s - TOLERANCE_S), max(0, v - TOLERANCE_V)])
-        upper_color = np.array([min(180, h + TOLERANCE_H), min(255, s + TOLERANCE_S), min(255, v + TOLERANCE_V)])
-        
-        print(f"Using HSV range: H({lower_color[0]}-{upper_color[0]}), S({lower_color[1]}-{upper_color[1]}), V({lower_color[2]}-{upper_color[2]})")
-        
-        # Step 3: Hit zone selection
-        print("\n=== STEP 3: SELECT HIT ZONE ===")
-        roi = select_roi(calibration_img)
-        
-        hit_zone = {
-            "left": osu_win.left + roi["x1"],
-            "top": osu_win.top + roi["y1"],
-            "width": roi["width"],
-            "height": roi["height"]
-        }
-        
-        print(f"Hit zone selected: {hit_zone}")
+    profile = load_profile(PROFILE_PATH, args.skin, osu_win.width, osu_win.height) if args.fast else None
+    if profile is not None and profile["lanes"] != len(KEYS):
+        # Lane geometry and per-lane colors would be wrong, treat it as missing
+        print(f"Profile {args.skin}@{osu_win.width}x{osu_win.height} was calibrated for {profile['lanes']}K "
+              f"but config has {len(KEYS)} keys, ignoring it")
+        profile = None
+    if profile is not None:
+        lower_color, upper_color, roi = profile["lower_color"], profile["upper_color"], profile["roi"]
+        class_lanes = profile.get("class_lanes")
+        print(f"Loaded profile {args.skin}@{osu_win.width}x{osu_win.height} (saved {profile['saved_at']})")
+    elif args.fast and not args.auto:
+        print(f"No profile for skin '{args.skin}' at {osu_win.width}x{osu_win.height}, run once without --fast")
+        return
+    else:
+        if args.auto:
+            calibration = auto_calibrate_window(osu_win)
+            if calibration is None:
+                print("No moving notes found, make sure osu is PLAYING with notes visible")
+                return
+            lower_color, upper_color, roi, class_lanes = calibration
+        else:
+            time.sleep(0.5)
+            lower_color, upper_color, roi, class_lanes = calibrate(osu_win)
+        timings = {"KEY_HOLD_TIME": KEY_HOLD_TIME, "HOLDER_THRESHOLD": HOLDER_THRESHOLD,
+                   "HOLDER_TAIL_GONE_TIME": HOLDER_TAIL_GONE_TIME, "HIT_ZONE_SIZE": HIT_ZONE_SIZE}
+        save_profile(PROFILE_PATH, args.skin, osu_win.width, osu_win.height,
+                     lower_color, upper_color, roi, len(KEYS), timings, class_lanes)
+        print(f"Saved profile {args.skin}@{osu_win.width}x{osu_win.height} to {PROFILE_PATH}")
+
+    hit_zone = {
+        "left": osu_win.left + roi["x1"],
+        "top": osu_win.top + roi["y1"],
+        "width": roi["width"],
+        "height": roi["height"]
+    }
+    print(f"Hit zone: {hit_zone}")
+
+    if args.latency:
+        measure_latency(hit_zone)
+        return
+
+    from bot import configure, run_bot
+    if profile is not None:
+        configure(**profile["timings"])
+    latency = load_input_latency(MACHINE_PATH)
+    if latency is not None:
+        configure(INPUT_LATENCY=latency)
+        if PREDICTIVE_MODE:
+            print(f"Input latency of this machine: {latency:g}ms, key events are scheduled that much earlier")
+        else:
+            print(f"Input latency of this machine: {latency:g}ms (ignored, only PREDICTIVE_MODE uses it)")
+    if profile is None and not args.auto:
         print("\n=== STEP 4: START BOT ===")
         print("Click back into osu and make sure game is PLAYING")
         print("Bot will start in 5 seconds...")
-        
+
         for countdown in range(5, 0, -1):
             print(f"Starting in {countdown}...", end='\r', flush=True)
             time.sleep(1)
         print("STARTING BOT!        \n")
-        
-        # Step 4: Run bot
-        run_bot(hit_zone, lower_color, upper_color)
 
-    cv2.destroyAllWindows()
+    # Step 4: Run bot
+    run_bot(hit_zone, lower_color, upper_color, class_lanes=class_lanes)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+"""Capture rate pacing with a low-rate idle mode while no notes are on screen"""
+
+import threading
+import time
+
+from instrumentation import LatencyHistogram, clock
+
+
+class FramePacer:
+    """Decides when the capture thread grabs its next frame
+
+    While notes are on screen frames are grabbed at `fps` (0 = as fast as
+    possible). Once the ROI has shown no note color for `idle_after` ms the
+    pacer drops to `idle_fps` polling, and the first frame with color puts it
+    straight back to full rate, waking the capture thread if it is sleeping.
+    A note is only seen in idle mode if an idle poll lands while it is in the
+    look-ahead rows above the hit band, so the idle interval has to be shorter
+    than the time a note takes to cross them; idle_rate() picks such a rate.
+
+    Wake-up latency is the time from the idle frame that saw color to the
+    next grab at full rate.
+    """
+
+    def __init__(self, fps, idle_fps=10, idle_after=1000):
+        self.interval = int(1e9 / fps) if fps else 0
+        self.idle_interval = int(1e9 / idle_fps)
+        self.idle_after = int(idle_after * 1e6)
+        self.idle = False
+        self.wake_latency = LatencyHistogram()
+        self.frames = {False: 0, True: 0}
+        self.time_in = {False: 0, True: 0}
+        self._last_color = clock()
+        self._last_grab = 0
+        self._woken_at = None
+        self._wake = threading.Event()
+        self._mode_since = clock()
+        self._wall_start = clock()
+        self._cpu_start = time.process_time()
+
+    def wait(self):
+        """Block the capture thread until the next frame is due at the current rate"""
+        while True:
+            idle = self.idle
+            interval = self.idle_interval if idle else self.interval
+            due = self._last_grab + interval
+            remaining = due - clock()
+            if remaining <= 0 or self._woken_at is not None:
+                break
+            if idle:
+                # Coarse sleep that update() or stop can cut short
+                if self._wake.wait(remaining / 1e9):
+                    self._wake.clear()
+            else:
+                time.sleep(remaining / 1e9)
+        now = clock()
+        if self._woken_at is not None:
+            self.wake_latency.record(now - self._woken_at)
+            self._woken_at = None
+        # Stay on the frame grid unless a whole interval was missed
+        self._last_grab = due if now - due < interval else now
+        self.frames[self.idle] += 1
+
+    def update(self, has_color, timestamp):
+        """Feed whether the frame captured at `timestamp` showed any note color"""
+        if has_color:
+            self._last_color = timestamp
+            if self.idle:
+                self._switch(False)
+                self._woken_at = timestamp
+                self._wake.set()
+        elif not self.idle and timestamp - self._last_color > self.idle_after:
+            self._switch(True)
+
+    def wake(self):
+        self._wake.set()
+
+    def _switch(self, idle):
+        now = clock()
+        self.time_in[self.idle] += now - self._mode_since
+        self._mode_since = now
+        self.idle = idle
+
+    def cpu_usage(self):
+        """Process CPU time over wall time since the pacer started, in % of one core"""
+        wall = (clock() - self._wall_start) / 1e9
+        return (time.process_time() - self._cpu_start) / wall * 100 if wall > 0 else 0
+
+    def summary_line(self):
+        time_in = dict(self.time_in)
+        time_in[self.idle] += clock() - self._mode_since
+        total = max(1, sum(time_in.values()))
+        parts = [f"CPU {self.cpu_usage():.0f}% of a core"]
+        for idle, name in ((False, "active"), (True, "idle")):
+            seconds = time_in[idle] / 1e9
+            rate = self.frames[idle] / seconds if seconds > 0 else 0
+            parts.append(f"{name} {time_in[idle] / total * 100:.0f}% at {rate:.0f} fps")
+        if self.wake_latency.count:
+            parts.append(f"{self.wake_latency.count} wake-ups p50={self.wake_latency.percentile(50) / 1000:.0f}us "
+                         f"max={self.wake_latency.max() / 1000:.0f}us (+ up to {self.idle_interval / 1e6:.0f}ms "
+                         f"idle polling)")
+        return " | ".join(parts)
+
+
+def idle_rate(idle_fps, lookahead_rows, max_speed):
+    """`idle_fps`, raised so a note scrolling at `max_speed` px/ms can't cross `lookahead_rows` between idle polls"""
+    return max(idle_fps, max_speed * 1000 / max(1, lookahead_rows))
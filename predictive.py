@@ -0,0 +1,140 @@
+"""Predictive press timing from the measured scroll speed"""
+
+import numpy as np
+
+from tracing import HOLDER, REPRESS, TAP, TIMEOUT
+
+
+class PredictiveLanes:
+    """Tracks the next note in every lane and schedules its press for when it reaches the hit line
+
+    The scroll speed (px/ms) is measured from how far the tracked notes move
+    between frames. A note is a holder when its measured length is over
+    `holder_threshold` ms or it runs past the top of the ROI, re-decided every
+    frame until its press fires. Taps are released `key_hold_time` ms after
+    their press. While a holder is held its tail (the top of the run covering
+    the hit line) is followed and the release is scheduled, and refined every
+    frame, for when the tail reaches the hit line. Should the tail be lost the
+    holder is released once its lane has been clear of color for
+    `holder_tail_gone_time` ms.
+
+    Notes are seen `latency` ms late and key events reach the game late too,
+    so every press and release is scheduled that much ahead of the hit line.
+    """
+
+    def __init__(self, lanes, hit_line, scheduler, key_hold_time, holder_threshold,
+                 holder_tail_gone_time, smoothing=0.2, repress_guard=40, latency=0):
+        self.lanes = lanes
+        self.hit_line = hit_line
+        self.scheduler = scheduler
+        self.key_hold_time = key_hold_time
+        self.holder_threshold = holder_threshold
+        self.holder_tail_gone_time = holder_tail_gone_time
+        self.smoothing = smoothing
+        self.repress_guard = int(repress_guard * 1e6)
+        self.latency = int(latency * 1e6)
+        self.speed = 0.0
+        self.prev_time = None
+        self.prev_found = np.zeros(lanes, dtype=bool)
+        self.prev_bottom = np.zeros(lanes, dtype=np.int64)
+        self.last_seen = np.zeros(lanes)
+        self.pending_press = [None] * lanes
+        self.pending_release = [None] * lanes
+        self.holding = [False] * lanes
+
+    def measure_speed(self, now, found, bottom):
+        if self.prev_time is not None and now > self.prev_time:
+            # Only the same note moving down gives a sample, a jump up means a new note
+            moved = found & self.prev_found & (bottom > self.prev_bottom) & (bottom - self.prev_bottom < self.hit_line // 2)
+            if moved.any():
+                sample = float(np.median(bottom[moved] - self.prev_bottom[moved])) / (now - self.prev_time)
+                if self.speed <= 0:
+                    self.speed = sample
+                else:
+                    self.speed += self.smoothing * (sample - self.speed)
+        self.prev_time = now
+        self.prev_found = found
+        self.prev_bottom = bottom
+
+    def update(self, timestamp, found, bottom, top, occupied, held_top=None):
+        """Feed one frame's detections, scheduling and moving key events as needed
+
+        held_top is LaneDetector.held_tops() at the hit line, used to follow holder tails.
+        """
+        now = timestamp / 1e6
+        self.last_seen[occupied] = now
+        self.measure_speed(now, found, bottom)
+        self.release_holders(timestamp, now, occupied)
+        if self.speed <= 0:
+            return
+        if held_top is not None:
+            self.track_tails(timestamp, held_top)
+        due = timestamp - self.latency + ((self.hit_line - bottom) / self.speed * 1e6).astype(np.int64)
+        hold = (top == 0) | ((bottom - top) / self.speed > self.holder_threshold)
+        for lane in np.flatnonzero(found):
+            self.plan(lane, max(int(due[lane]), timestamp), bool(hold[lane]), timestamp)
+
+    def plan(self, lane, due, hold, captured):
+        press = self.pending_press[lane]
+        release = self.pending_release[lane]
+        if press is not None and not press.fired and due - press.due < self.repress_guard:
+            # Same note seen again, refine its time and tap/hold call with the newer measurement
+            press = self.pending_press[lane] = self.scheduler.reschedule(press, due, captured) or press
+            press.reason = HOLDER if hold else TAP
+            if hold and release is not None:
+                self.scheduler.cancel(release)
+                self.pending_release[lane] = None
+            elif not hold and release is None:
+                self.pending_release[lane] = self.scheduler.schedule(due + int(self.key_hold_time * 1e6), lane, "release")
+            elif release is not None and not release.fired:
+                self.pending_release[lane] = self.scheduler.reschedule(release, due + int(self.key_hold_time * 1e6))
+            self.holding[lane] = hold
+            return
+        if press is not None and due - press.due < self.repress_guard:
+            return
+        if self.holding[lane]:
+            # Still holding the previous note: let go just before this one
+            if release is not None and not release.fired:
+                release = self.scheduler.reschedule(release, min(release.due, due - 1_000_000))
+                if release is not None:
+                    release.reason = REPRESS
+            else:
+                self.scheduler.schedule(due - 1_000_000, lane, "release", REPRESS)
+            self.holding[lane] = False
+        self.pending_press[lane] = self.scheduler.schedule(due, lane, "press", HOLDER if hold else TAP, captured)
+        self.pending_release[lane] = None
+        if hold:
+            self.holding[lane] = True
+        else:
+            self.pending_release[lane] = self.scheduler.schedule(due + int(self.key_hold_time * 1e6), lane, "release")
+
+    def track_tails(self, timestamp, held_top):
+        """Schedule (or refine) each held holder's release for when its tail reaches the hit line"""
+        for lane in range(self.lanes):
+            press = self.pending_press[lane]
+            if not self.holding[lane] or press is None or not press.fired or held_top[lane] <= 0:
+                continue
+            due = max(timestamp, timestamp - self.latency + int((self.hit_line - held_top[lane]) / self.speed * 1e6))
+            release = self.pending_release[lane]
+            if release is None:
+                self.pending_release[lane] = self.scheduler.schedule(due, lane, "release", HOLDER)
+            elif not release.fired:
+                release = self.pending_release[lane] = self.scheduler.reschedule(release, due) or release
+                release.reason = HOLDER
+
+    def release_holders(self, timestamp, now, occupied):
+        for lane in range(self.lanes):
+            if not self.holding[lane]:
+                continue
+            release = self.pending_release[lane]
+            if release is not None and release.fired:
+                self.holding[lane] = False
+                continue
+            press = self.pending_press[lane]
+            if (not occupied[lane] and press is not None and press.fired
+                    and now - self.last_seen[lane] > self.holder_tail_gone_time):
+                # Tail lost, let go now
+                if release is not None:
+                    self.scheduler.cancel(release)
+                self.pending_release[lane] = self.scheduler.schedule(timestamp, lane, "release", TIMEOUT)
+                self.holding[lane] = False
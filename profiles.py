@@ -0,0 +1,67 @@
+"""Saved calibration profiles keyed by skin name and window size, and per-machine input latency"""
+
+import json
+import os
+import platform
+import time
+
+import numpy as np
+
+
+def profile_key(skin, width, height):
+    return f"{skin}@{width}x{height}"
+
+
+def load_profiles(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_profile(path, skin, width, height):
+    """Return the profile saved for this skin and window size, or None"""
+    return load_profiles(path).get(profile_key(skin, width, height))
+
+
+def save_profile(path, skin, width, height, lower_color, upper_color, roi, lanes, timings, class_lanes=None):
+    """Store a calibration: HSV ranges, ROI relative to the window, lane geometry and timings"""
+    profiles = load_profiles(path)
+    profiles[profile_key(skin, width, height)] = {
+        "lower_color": np.asarray(lower_color, dtype=int).tolist(),
+        "upper_color": np.asarray(upper_color, dtype=int).tolist(),
+        "class_lanes": class_lanes,
+        "roi": {name: int(roi[name]) for name in ("x1", "y1", "width", "height")},
+        "lanes": lanes,
+        "lane_width": int(roi["width"]) // lanes,
+        "timings": timings,
+        "saved_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    _write(path, profiles)
+    return profiles[profile_key(skin, width, height)]
+
+
+def load_input_latency(path, machine=None):
+    """Input latency in ms measured on this machine (or `machine`), or None"""
+    entry = load_profiles(path).get(machine or platform.node())
+    return None if entry is None else entry["input_latency"]
+
+
+def save_input_latency(path, latency, spread, samples, machine=None):
+    """Store a measured key press to screen round trip (median and IQR in ms) for this machine"""
+    machines = load_profiles(path)
+    machines[machine or platform.node()] = {
+        "input_latency": round(float(latency), 2),
+        "spread": round(float(spread), 2),
+        "samples": len(samples),
+        "saved_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    _write(path, machines)
+    return machines[machine or platform.node()]
+
+
+def _write(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
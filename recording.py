@@ -0,0 +1,110 @@
+"""Memory-mapped session recordings of raw hit zone frames
+
+A session `name` is three files:
+  name.frames  raw BGRA frames back to back, (count, height, width, 4) uint8
+  name.idx     int64 capture timestamps (perf_counter_ns), one per frame
+  name.json    shape and free-form metadata (hit zone, HSV range, keys, ...)
+"""
+
+import json
+import mmap
+import os
+
+import numpy as np
+
+
+class _MappedArray:
+    """Append-only array backed by a file that grows in chunks of rows"""
+
+    def __init__(self, path, row_shape, dtype, chunk_rows):
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.row_bytes = int(np.prod(self.row_shape)) * self.dtype.itemsize
+        self.chunk_rows = chunk_rows
+        self.capacity = 0
+        self.file = open(path, "w+b")
+        self.map = None
+        self.array = None
+        self.grow()
+
+    def grow(self):
+        self.array = None
+        if self.map is not None:
+            self.map.close()
+        self.capacity += self.chunk_rows
+        self.file.truncate(self.capacity * self.row_bytes)
+        self.map = mmap.mmap(self.file.fileno(), self.capacity * self.row_bytes)
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            self.map.madvise(mmap.MADV_SEQUENTIAL)
+        self.array = np.frombuffer(self.map, dtype=self.dtype).reshape((self.capacity,) + self.row_shape)
+
+    def close(self, rows):
+        self.array = None
+        self.map.flush()
+        self.map.close()
+        self.file.truncate(rows * self.row_bytes)
+        self.file.close()
+
+
+class SessionRecorder:
+    """Appends frames and their timestamps to a session, cheap enough to leave on live"""
+
+    def __init__(self, path, shape, meta=None, chunk_frames=512):
+        self.path = path
+        self.shape = tuple(shape)
+        self.meta = dict(meta or {})
+        self.count = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._frames = _MappedArray(path + ".frames", self.shape, np.uint8, chunk_frames)
+        self._index = _MappedArray(path + ".idx", (), np.int64, chunk_frames)
+
+    def append(self, frame, timestamp):
+        if self.count == self._frames.capacity:
+            self._frames.grow()
+            self._index.grow()
+        self._frames.array[self.count] = frame
+        self._index.array[self.count] = timestamp
+        self.count += 1
+
+    def close(self):
+        self._frames.close(self.count)
+        self._index.close(self.count)
+        with open(self.path + ".json", "w") as f:
+            json.dump({"shape": self.shape, "count": self.count, "meta": self.meta}, f, indent=2)
+
+
+class SessionReader:
+    """Zero-copy access to a recorded session, frames are views into the mapped file"""
+
+    def __init__(self, path):
+        if path.endswith(".json"):
+            path = path[:-len(".json")]
+        self.path = path
+        with open(path + ".json") as f:
+            info = json.load(f)
+        self.shape = tuple(info["shape"])
+        self.meta = info.get("meta", {})
+        self.timestamps = np.fromfile(path + ".idx", dtype=np.int64)
+        count = len(self.timestamps)
+        if count:
+            self.frames = np.memmap(path + ".frames", dtype=np.uint8, mode="r", shape=(count,) + self.shape)
+        else:
+            self.frames = np.empty((0,) + self.shape, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, i):
+        return self.frames[i], int(self.timestamps[i])
+
+    def seek(self, timestamp):
+        """Index of the first frame captured at or after `timestamp` (ns)"""
+        return int(np.searchsorted(self.timestamps, timestamp))
+
+    def seek_ms(self, offset):
+        """Index of the first frame `offset` ms into the session"""
+        if not len(self):
+            return 0
+        return self.seek(self.timestamps[0] + int(offset * 1e6))
@@ -0,0 +1,148 @@
+"""Headless replay of recorded or synthetic frames through the bot pipeline"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from bot import Bot
+from calibration import hsv_range
+from capture import FileSource
+from config import KEYS
+from recording import SessionRecorder
+
+NOTE_BGR = (40, 40, 230)
+
+
+class FakeController:
+    """Stand-in for pynput's Controller that records (timestamp, key, action)
+
+    With no clock the events are stamped with `now`, which replay() sets to the
+    capture time of the frame being processed.
+    """
+
+    def __init__(self, clock=None):
+        self.clock = clock
+        self.now = 0
+        self.events = []
+
+    def press(self, key):
+        self.events.append((self.clock() if self.clock else self.now, key, "press"))
+
+    def release(self, key):
+        self.events.append((self.clock() if self.clock else self.now, key, "release"))
+
+
+def note_color_range(bgr=NOTE_BGR):
+    h, s, v = cv2.cvtColor(np.uint8([[bgr]]), cv2.COLOR_BGR2HSV)[0, 0]
+    return hsv_range(int(h), int(s), int(v))
+
+
+def synthetic_session(width=540, height=400, lanes=None, count=600, fps=240,
+                      speed=1.5, note_height=30, seed=0, color=NOTE_BGR):
+    """Render `count` frames of notes scrolling down at `speed` px/ms
+
+    Returns (frames, timestamps, notes) where notes is a list of
+    (lane, hit_time_ms) for the moment each note's bottom edge reaches the
+    bottom row.
+    """
+    lanes = lanes or len(KEYS)
+    rng = np.random.default_rng(seed)
+    lane_width = width // lanes
+    duration = count * 1000 / fps
+    notes = []
+    for lane in range(lanes):
+        t = rng.uniform(50, 300)
+        while t < duration:
+            notes.append((lane, t))
+            t += rng.uniform(120, 600)
+
+    frames = np.zeros((count, height, width, 4), dtype=np.uint8)
+    frames[..., 3] = 255
+    timestamps = (np.arange(count) * (1e9 / fps)).astype(np.int64)
+    for n, frame in enumerate(frames):
+        now = timestamps[n] / 1e6
+        for lane, hit_time in notes:
+            bottom = height - 1 - int((hit_time - now) * speed)
+            if bottom < 0 or bottom - note_height >= height:
+                continue
+            top = max(0, bottom - note_height + 1)
+            x = lane * lane_width
+            frame[top:bottom + 1, x + 4:x + lane_width - 4, :3] = color
+    return frames, timestamps, notes
+
+
+def save_session(path, frames, timestamps, meta=None):
+    recorder = SessionRecorder(path, frames.shape[1:], meta)
+    for frame, timestamp in zip(frames, timestamps):
+        recorder.append(frame, timestamp)
+    recorder.close()
+
+
+def replay(source, lower_color, upper_color, keyboard=None, class_lanes=None, stats=None, trace=None):
+    """Process every frame of `source` synchronously, returns the keyboard used"""
+    keyboard = keyboard or FakeController()
+    height, width = source.shape[:2]
+    bot = Bot(width, height, lower_color, upper_color, keyboard, stats, class_lanes=class_lanes, trace=trace)
+    img = np.empty(source.shape, dtype=np.uint8)
+    source.open()
+    try:
+        while True:
+            if hasattr(source, "read"):
+                # Recorded frames are processed straight from the mapped file
+                frame = source.read()
+                if frame is None:
+                    break
+                img, timestamp = frame
+            else:
+                timestamp = source.read_into(img)
+                if timestamp is None:
+                    break
+            if bot.scheduler is not None:
+                bot.scheduler.poll(timestamp)
+            keyboard.now = timestamp
+            bot.process(img, timestamp)
+        if bot.scheduler is not None:
+            bot.scheduler.poll(float("inf"))
+    finally:
+        source.close()
+        bot.release_all()
+    return keyboard
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("frames", nargs="?", help="recorded session or .npy/.npz frames to replay (default: synthetic)")
+    parser.add_argument("--hsv", type=int, nargs=3, metavar=("H", "S", "V"), help="picked note color")
+    parser.add_argument("--fps", type=int, default=240, help="frame rate assumed for files without timestamps")
+    parser.add_argument("--save", metavar="PATH", help="also record the synthetic session to PATH")
+    args = parser.parse_args()
+
+    lower_color, upper_color = hsv_range(*args.hsv) if args.hsv else note_color_range()
+    class_lanes = None
+    if args.frames:
+        source = FileSource(args.frames, fps=args.fps, realtime=False)
+        if not args.hsv and "lower_color" in source.meta:
+            lower_color, upper_color = np.array(source.meta["lower_color"]), np.array(source.meta["upper_color"])
+            class_lanes = source.meta.get("class_lanes")
+    else:
+        frames, timestamps, notes = synthetic_session(fps=args.fps)
+        source = FileSource(frames, timestamps, realtime=False)
+        print(f"Synthetic session: {len(frames)} frames, {len(notes)} notes")
+        if args.save:
+            save_session(args.save, frames, timestamps, {"lower_color": lower_color.tolist(),
+                                                         "upper_color": upper_color.tolist(), "keys": KEYS})
+            print(f"Saved session to {args.save}")
+
+    start = time.perf_counter()
+    keyboard = replay(source, lower_color, upper_color, class_lanes=class_lanes)
+    elapsed = time.perf_counter() - start
+    presses = [e for e in keyboard.events if e[2] == "press"]
+    print(f"Replayed {len(source.frames)} frames in {elapsed:.2f}s ({len(source.frames) / elapsed:.0f} fps)")
+    for key in KEYS:
+        print(f"  {key}: {sum(1 for e in presses if e[1] == key)} presses")
+
+
+if __name__ == "__main__":
+    main()
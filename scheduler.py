@@ -0,0 +1,150 @@
+"""High-resolution key event scheduler"""
+
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+from tracing import PRESS, RELEASE, TAP
+
+
+class ScheduledEvent:
+    """A key press or release due at a perf_counter_ns time, can be moved until it fires
+
+    `captured` is the capture time of the frame its due time was last worked
+    out from, if known.
+    """
+
+    __slots__ = ("due", "lane", "action", "reason", "captured", "cancelled", "fired", "fired_at")
+
+    def __init__(self, due, lane, action, reason=TAP, captured=None):
+        self.due = due
+        self.lane = lane
+        self.action = action
+        self.reason = reason
+        self.captured = captured
+        self.cancelled = False
+        self.fired = False
+        self.fired_at = None
+
+
+class PressScheduler:
+    """Fires key events at their due time
+
+    start() runs a thread that sleeps until shortly before the next event and
+    spins for the last `spin_ns`, so events fire within microseconds of their
+    due time regardless of capture jitter. The spin yields the GIL with
+    sleep(0) on every turn: the detection loop keeps running beside it, at the
+    cost of firing a thread switch late when it is busy. Without the thread, poll(now) fires
+    everything due by `now` on a virtual clock, which is what offline replay
+    uses. Fired events go to `trace` (an EventTrace) with their reason and
+    how late they fired, and the last `history` fired events are kept for
+    jitter(). Presses with a capture time go to the end-to-end histogram of
+    `stats` (an Instrumentation).
+    """
+
+    def __init__(self, keyboard, keys, spin_ns=1_000_000, clock=time.perf_counter_ns, trace=None, history=4096,
+                 stats=None):
+        self.keyboard = keyboard
+        self.keys = keys
+        self.trace = trace
+        self.stats = stats
+        self.spin_ns = spin_ns
+        self.clock = clock
+        self.fired = collections.deque(maxlen=history)
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def schedule(self, due, lane, action, reason=TAP, captured=None):
+        event = ScheduledEvent(due, lane, action, reason, captured)
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._counter), event))
+            self._cond.notify()
+        return event
+
+    def reschedule(self, event, due, captured=None):
+        """Move a pending event, returns the event now in the queue (None if it already fired)
+
+        `captured` replaces the event's capture time when the new due time comes from a newer frame.
+        """
+        with self._cond:
+            if event.fired:
+                return None
+            event.cancelled = True
+        return self.schedule(due, event.lane, event.action, event.reason, captured or event.captured)
+
+    def cancel(self, event):
+        with self._cond:
+            event.cancelled = True
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            event = heapq.heappop(self._heap)[2]
+            if not event.cancelled:
+                event.fired = True
+                due.append(event)
+        return due
+
+    def _fire(self, event, fired_at):
+        key = self.keys[event.lane]
+        if event.action == "press":
+            self.keyboard.press(key)
+        else:
+            self.keyboard.release(key)
+        event.fired_at = fired_at
+        self.fired.append(event)
+        if self.stats is not None and event.action == "press" and event.captured is not None:
+            self.stats.end_to_end.record(fired_at - event.captured)
+        if self.trace is not None:
+            self.trace.key(fired_at, PRESS if event.action == "press" else RELEASE, event.lane, event.reason,
+                           fired_at - event.due)
+
+    def poll(self, now):
+        """Fire every event due by `now`, each stamped with its own due time"""
+        with self._cond:
+            events = self._pop_due(now)
+        for event in events:
+            if hasattr(self.keyboard, "now"):
+                self.keyboard.now = event.due
+            self._fire(event, event.due)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+    def _run(self):
+        clock = self.clock
+        while True:
+            with self._cond:
+                while self._running and (not self._heap or self._heap[0][0] - clock() > self.spin_ns):
+                    timeout = None
+                    if self._heap:
+                        timeout = (self._heap[0][0] - clock() - self.spin_ns) / 1e9
+                    self._cond.wait(timeout)
+                if not self._running:
+                    return
+                due = self._heap[0][0]
+            while clock() < due:
+                time.sleep(0)
+            now = clock()
+            with self._cond:
+                events = self._pop_due(now)
+            for event in events:
+                self._fire(event, clock())
+
+    def jitter(self):
+        """Fire time minus due time (ns) of the recently fired events"""
+        return [event.fired_at - event.due for event in self.fired]
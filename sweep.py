@@ -0,0 +1,228 @@
+"""Parallel sweep of detection and timing settings over recorded sessions of known charts
+
+Every session is replayed through the bot once per point of the settings
+grid and graded against its chart. Runs are spread over a process pool;
+workers map the session files read-only, so the frames live once in the
+page cache however many workers read them. Points are ranked by missed plus
+false press rate, then accuracy and timing error, then per-frame cost.
+
+Sessions rendered with --render carry their chart in the metadata; a live
+recording (RECORD_DIR) needs --chart and --origin, the chart time in ms of
+its first frame.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from bot import configure
+from capture import FileSource
+from charts import ChartSource, Note, judge, load_chart, random_chart
+from config import (CAPTURE_LOOKAHEAD, HIT_ZONE_SIZE, HOLDER_TAIL_GONE_TIME, HOLDER_THRESHOLD, KEYS, TOLERANCE_H,
+                    TOLERANCE_S, TOLERANCE_V)
+from instrumentation import Instrumentation
+from recording import SessionRecorder
+from replay import NOTE_BGR, replay
+
+# Swept settings with their command line flag and config default
+PARAMETERS = {
+    "TOLERANCE_H": ("--tolerance-h", TOLERANCE_H),
+    "TOLERANCE_S": ("--tolerance-s", TOLERANCE_S),
+    "TOLERANCE_V": ("--tolerance-v", TOLERANCE_V),
+    "HIT_ZONE_SIZE": ("--hit-zone", HIT_ZONE_SIZE),
+    "HOLDER_THRESHOLD": ("--holder-threshold", HOLDER_THRESHOLD),
+    "HOLDER_TAIL_GONE_TIME": ("--tail-gone", HOLDER_TAIL_GONE_TIME),
+}
+
+_sessions = {}
+
+
+def record_chart(notes, info, path, fps=240, speed=1.5, color=NOTE_BGR, lane_width=48, noise=0, seed=0):
+    """Render a chart into a session whose metadata holds the chart, for sweeps with a known answer
+
+    `noise` adds up to that many levels of random brightness to every pixel so
+    the HSV tolerances have something to separate.
+    """
+    lanes = info["keys"]
+    source = ChartSource(notes, lanes, lane_width, HIT_ZONE_SIZE + (CAPTURE_LOOKAHEAD or 0), fps, speed,
+                         color=color)
+    h, s, v = cv2.cvtColor(np.uint8([[color]]), cv2.COLOR_BGR2HSV)[0, 0]
+    meta = {"keys": KEYS if len(KEYS) == lanes else [str(lane) for lane in range(lanes)],
+            "picked": [[int(h), int(s), int(v)]],
+            "chart": {"title": info["title"], "od": info["od"], "origin": source.origin,
+                      "notes": [list(note) for note in notes]}}
+    recorder = SessionRecorder(path, source.shape, meta)
+    rng = np.random.default_rng(seed)
+    img = np.empty(source.shape, dtype=np.uint8)
+    source.open()
+    try:
+        while True:
+            timestamp = source.read_into(img)
+            if timestamp is None:
+                break
+            if noise:
+                # Added in int16 and saturated, uint8 would wrap bright channels around to black
+                noisy = img[..., :3] + rng.integers(0, noise, img.shape[:2] + (3,), dtype=np.int16)
+                img[..., :3] = np.minimum(noisy, 255)
+            recorder.append(img, timestamp)
+    finally:
+        recorder.close()
+    return len(source)
+
+
+def chart_from_file(path, origin):
+    notes, info = load_chart(path)
+    return {"title": info["title"], "od": info["od"], "origin": origin, "notes": [list(note) for note in notes]}
+
+
+def tolerance_range(picked, tolerance_h, tolerance_s, tolerance_v):
+    """HSV ranges around the picked colors, as calibration.hsv_range with these tolerances"""
+    picked = np.atleast_2d(picked)
+    tolerance = np.array([tolerance_h, tolerance_s, tolerance_v])
+    return np.maximum(picked - tolerance, 0), np.minimum(picked + tolerance, [180, 255, 255])
+
+
+def picked_colors(meta):
+    """Picked HSV colors of a session, or the middle of its recorded ranges"""
+    if "picked" in meta:
+        return np.asarray(meta["picked"])
+    return (np.atleast_2d(meta["lower_color"]) + np.atleast_2d(meta["upper_color"])) // 2
+
+
+def _open_sessions(paths):
+    for path in paths:
+        _sessions[path] = FileSource(path, realtime=False)
+
+
+def run_point(path, chart, settings, fixed):
+    """Replay one session with `settings` on top of `fixed`, returns its counts and cost"""
+    source = _sessions[path]
+    meta = source.meta
+    values = {name: default for name, (_, default) in PARAMETERS.items()}
+    values.update(settings)
+    keys = meta.get("keys", KEYS)
+    configure(KEYS=keys, **fixed, **values)
+    lower_color, upper_color = tolerance_range(picked_colors(meta), values["TOLERANCE_H"], values["TOLERANCE_S"],
+                                               values["TOLERANCE_V"])
+    stats = Instrumentation()
+    keyboard = replay(source, lower_color, upper_color, class_lanes=meta.get("class_lanes"), stats=stats)
+    notes = [Note(*note) for note in chart["notes"]]
+    origin = chart["origin"] - int(source.timestamps[0]) / 1e6
+    result = judge(notes, keyboard.events, keys, chart["od"], origin)
+    errors = np.abs(result["press_errors"]) if result["press_errors"] else np.zeros(1)
+    return {
+        "notes": len(notes),
+        "frames": stats.frames,
+        "presses": sum(1 for _, _, action in keyboard.events if action == "press"),
+        "missed": result["press"]["miss"],
+        "extra": result["extra_presses"],
+        "judged": sum((result["press"] + result["release"]).values()),
+        "score": result["accuracy"] * sum((result["press"] + result["release"]).values()),
+        "error_sum": float(errors.sum()),
+        "frame_ns": sum(stats.histograms[stage].mean() for stage in ("classify", "decision", "dispatch"))
+                    * stats.frames,
+    }
+
+
+def summarize(settings, runs):
+    """Totals of one grid point over every session, with its rates and mean per-frame cost"""
+    total = collections.Counter()
+    for run in runs:
+        total.update(run)
+    return {
+        "settings": settings,
+        "notes": total["notes"],
+        "missed": total["missed"],
+        "extra": total["extra"],
+        "miss_rate": total["missed"] / max(1, total["notes"]),
+        "false_rate": total["extra"] / max(1, total["presses"]),
+        "accuracy": total["score"] / max(1, total["judged"]),
+        "mean_abs_error": total["error_sum"] / max(1, total["notes"] - total["missed"]),
+        "frame_us": total["frame_ns"] / max(1, total["frames"]) / 1000,
+    }
+
+
+def sweep(sessions, grid, fixed=None, workers=None):
+    """Replay every (session, chart) pair at every grid point in a process pool, returns ranked summaries"""
+    fixed = fixed or {}
+    names = list(grid)
+    points = [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+    runs = collections.defaultdict(list)
+    paths = [path for path, _ in sessions]
+    started = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_open_sessions, initargs=(paths,)) as pool:
+        futures = {pool.submit(run_point, path, chart, point, fixed): i
+                   for i, point in enumerate(points) for path, chart in sessions}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            runs[futures[future]].append(future.result())
+            print(f"{done}/{len(futures)} runs, {time.perf_counter() - started:.0f}s", end="\r", flush=True)
+    print()
+    results = [summarize(point, runs[i]) for i, point in enumerate(points)]
+    results.sort(key=lambda r: (r["miss_rate"] + r["false_rate"], -r["accuracy"], r["mean_abs_error"], r["frame_us"]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sessions", nargs="*", help="recorded sessions to replay")
+    parser.add_argument("--chart", help=".osu beatmap or simple chart played in a live session")
+    parser.add_argument("--origin", type=float, default=0, help="chart time in ms of the session's first frame")
+    parser.add_argument("--render", metavar="PATH",
+                        help="first render --chart (default: random) into a session at PATH and sweep it too")
+    parser.add_argument("--fps", type=int, default=240, help="frame rate of the rendered session")
+    parser.add_argument("--noise", type=int, default=0, help="random brightness added to rendered pixels")
+    for name, (flag, default) in PARAMETERS.items():
+        parser.add_argument(flag, type=int, nargs="+", default=[default], metavar="N", help=f"{name} values")
+    parser.add_argument("--predictive", action="store_true", help="sweep with PREDICTIVE_MODE on")
+    parser.add_argument("--workers", type=int, help="processes in the pool (default: one per core)")
+    parser.add_argument("--top", type=int, default=10, help="ranked settings to print")
+    parser.add_argument("--output", help="write every ranked result as JSON")
+    args = parser.parse_args()
+
+    sessions = []
+    if args.render:
+        notes, info = load_chart(args.chart) if args.chart else random_chart(duration=10000)
+        frames = record_chart(notes, info, args.render, args.fps, noise=args.noise)
+        print(f"Rendered {info['title']} ({len(notes)} notes, {frames} frames) to {args.render}")
+        sessions.append(args.render)
+    sessions += args.sessions
+    if not sessions:
+        parser.error("no sessions, give recorded sessions or --render PATH")
+
+    pairs = []
+    for path in sessions:
+        meta = FileSource(path, realtime=False).meta
+        if "chart" in meta:
+            pairs.append((path, meta["chart"]))
+        elif args.chart:
+            pairs.append((path, chart_from_file(args.chart, args.origin)))
+        else:
+            parser.error(f"{path} has no chart, pass --chart and --origin")
+
+    grid = {name: getattr(args, flag[2:].replace("-", "_")) for name, (flag, _) in PARAMETERS.items()}
+    points = int(np.prod([len(values) for values in grid.values()]))
+    print(f"Sweeping {points} settings over {len(pairs)} sessions with {args.workers or os.cpu_count()} workers")
+    results = sweep(pairs, grid, {"PREDICTIVE_MODE": args.predictive}, args.workers)
+
+    varied = [name for name, values in grid.items() if len(values) > 1] or list(grid)
+    print(" rank  " + " ".join(f"{PARAMETERS[name][0][2:]:>16}" for name in varied)
+          + "   missed   false  accuracy  |err|ms  us/frame")
+    for rank, r in enumerate(results[:args.top], 1):
+        print(f"{rank:5d}  " + " ".join(f"{r['settings'][name]:>16}" for name in varied)
+              + f"  {r['miss_rate'] * 100:6.2f}% {r['false_rate'] * 100:6.2f}%  {r['accuracy'] * 100:7.2f}%"
+              + f"  {r['mean_abs_error']:7.1f}  {r['frame_us']:8.0f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Fixed-memory binary trace of frames and key events, dumped to a file and converted to Chrome trace JSON
+
+Every record takes `record_size` bytes of one preallocated ring:
+  timestamp  int64  perf_counter_ns: capture time of the frame a record comes from, fire time of scheduled keys
+  value      int64  ns from that time to the decision, or how late a scheduled key fired
+  kind       uint8  FRAME, PRESS or RELEASE
+  reason     uint8  TAP, HOLDER, TIMEOUT or REPRESS for key events
+  lane       uint8  lane of a key event
+  lanes      uint8  lanes in a frame record
+  frame records then hold `lanes` occupancy bools and `lanes` int64 bottom rows.
+
+A dump file is a FILE_HEADER followed by the records oldest first.
+"""
+
+import argparse
+import itertools
+import json
+import struct
+import sys
+import threading
+
+from instrumentation import clock
+
+FRAME, PRESS, RELEASE, EMPTY = 0, 1, 2, 255
+TAP, HOLDER, TIMEOUT, REPRESS = range(4)
+KINDS = {FRAME: "frame", PRESS: "press", RELEASE: "release"}
+REASONS = ("tap", "holder", "timeout", "repress")
+
+MAX_LANES = 10
+HEADER = struct.Struct("<qqBBBB")
+_pack_header = HEADER.pack_into
+FILE_HEADER = struct.Struct("<8sHHQ")
+MAGIC = b"OMTRACE1"
+
+
+def _frame_struct(lanes):
+    """Frame record layout, padded to 8 bytes; the arrays are packed as raw bytes, cheaper than one field each"""
+    fmt = f"<qqBBBB{lanes}s{lanes * 8}s"
+    return struct.Struct(fmt + f"{-struct.calcsize(fmt) % 8}x")
+
+
+class EventTrace:
+    """Ring of the last `capacity` records, written with struct.pack_into and never reallocated
+
+    Slots are claimed with next() on an itertools.count, which the GIL makes
+    atomic, so the detection loop and the scheduler thread can both write
+    without a lock. Once full, the oldest records are overwritten.
+    """
+
+    def __init__(self, capacity, lanes):
+        if lanes > MAX_LANES:
+            raise ValueError(f"at most {MAX_LANES} lanes can be traced")
+        self.capacity = capacity
+        self.lanes = lanes
+        self._frame = _frame_struct(lanes)
+        self.record_size = self._frame.size
+        self.buffer = bytearray(capacity * self.record_size)
+        self._counter = itertools.count()
+        # Bound once, attribute lookups are a fair share of a record's cost
+        self._next = self._counter.__next__
+        self._pack_frame = self._frame.pack_into
+
+    def frame(self, timestamp, occupied, bottom):
+        """Record one frame's per-lane occupancy and bottom row (bool and int64 arrays)"""
+        self._pack_frame(self.buffer, self._next() % self.capacity * self.record_size, timestamp, clock() - timestamp,
+                         FRAME, 0, 0, self.lanes, occupied.tobytes(), bottom.tobytes())
+
+    def key(self, timestamp, kind, lane, reason, delay=0):
+        """Record a PRESS or RELEASE of `lane` at `timestamp`, decided or fired `delay` ns after it"""
+        _pack_header(self.buffer, self._next() % self.capacity * self.record_size, timestamp, delay, kind, reason,
+                     lane, 0)
+
+    def snapshot(self):
+        """(total records ever written, bytes of the kept records oldest first)"""
+        # Claims one slot and marks it empty, no writer touches it until the ring wraps
+        written = self._next()
+        slot = written % self.capacity
+        HEADER.pack_into(self.buffer, slot * self.record_size, 0, 0, EMPTY, 0, 0, 0)
+        data = bytes(self.buffer)
+        if written < self.capacity:
+            return written, data[:written * self.record_size]
+        start = (slot + 1) * self.record_size
+        return written, data[start:] + data[:slot * self.record_size]
+
+    def dump(self, path):
+        """Write the ring to `path`, returns the number of records kept
+
+        Only copies and writes bytes, so it is safe from another thread while
+        the bot plays; convert_trace() makes the Chrome trace JSON later.
+        """
+        written, data = self.snapshot()
+        with open(path, "wb") as f:
+            f.write(FILE_HEADER.pack(MAGIC, self.record_size, self.lanes, written))
+            f.write(data)
+        return len(data) // self.record_size
+
+
+def decode(data, lanes):
+    """Yield (timestamp, value, kind, reason, lane, occupied, bottom) for every record in `data`"""
+    frame = _frame_struct(lanes)
+    rows = struct.Struct(f"<{lanes}q")
+    for offset in range(0, len(data) - frame.size + 1, frame.size):
+        timestamp, value, kind, reason, lane, _ = HEADER.unpack_from(data, offset)
+        if kind == FRAME:
+            occupied, bottom = frame.unpack_from(data, offset)[6:8]
+            yield timestamp, value, kind, reason, lane, tuple(map(bool, occupied)), rows.unpack(bottom)
+        elif kind != EMPTY:
+            yield timestamp, value, kind, reason, lane, None, None
+
+
+def load_trace(path):
+    """Records and lane count of a dump file"""
+    with open(path, "rb") as f:
+        magic, record_size, lanes, _ = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+        if magic != MAGIC or record_size != _frame_struct(lanes).size:
+            raise ValueError(f"{path} is not an event trace")
+        return list(decode(f.read(), lanes)), lanes
+
+
+def write_chrome_trace(records, lanes, path):
+    """Frames as slices with a per-lane bottom row counter, keys as instants and held spans per lane"""
+    records = sorted(records, key=lambda record: record[0])
+    origin = records[0][0] if records else 0
+    events = [{"name": "process_name", "ph": "M", "pid": 1, "args": {"name": "osu!mania bot"}},
+              {"name": "thread_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": "frames"}}]
+    events += [{"name": "thread_name", "ph": "M", "pid": 1, "tid": lane + 1, "args": {"name": f"lane {lane + 1}"}}
+               for lane in range(lanes)]
+    pressed_at = {}
+    for timestamp, value, kind, reason, lane, occupied, bottom in records:
+        ts = (timestamp - origin) / 1000
+        if kind == FRAME:
+            events.append({"name": "frame", "ph": "X", "pid": 1, "tid": 0, "ts": ts, "dur": value / 1000,
+                           "args": {"occupied": [int(o) for o in occupied], "bottom": list(bottom)}})
+            events.append({"name": "bottom row", "ph": "C", "pid": 1, "ts": ts,
+                           "args": {f"lane {i + 1}": b if o else -1 for i, (o, b) in enumerate(zip(occupied, bottom))}})
+            continue
+        events.append({"name": f"{KINDS[kind]} ({REASONS[reason]})", "ph": "i", "s": "t", "pid": 1, "tid": lane + 1,
+                       "ts": ts, "args": {"delay_us": value / 1000}})
+        if kind == PRESS:
+            pressed_at[lane] = ts
+        elif lane in pressed_at:
+            start = pressed_at.pop(lane)
+            events.append({"name": "held", "ph": "X", "pid": 1, "tid": lane + 1, "ts": start, "dur": ts - start,
+                           "args": {"release": REASONS[reason]}})
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def convert_trace(path, output=None):
+    """Write the Chrome / Perfetto trace JSON of a dump (default: next to it), returns (output, record count)"""
+    records, lanes = load_trace(path)
+    output = output or path.rsplit(".", 1)[0] + ".json"
+    write_chrome_trace(records, lanes, output)
+    return output, len(records)
+
+
+class WindowsHotkey(threading.Thread):
+    """RegisterHotKey on a thread of its own, calling `callback` on every WM_HOTKEY
+
+    Unlike a low-level keyboard hook, Windows only tells this thread about
+    the one registered key, so the keys the bot sends never wait on Python.
+    """
+
+    def __init__(self, name, callback):
+        super().__init__(name="hotkey", daemon=True)
+        import ctypes
+
+        self._user32 = ctypes.windll.user32
+        self._kernel32 = ctypes.windll.kernel32
+        if name.lower().startswith("f") and name[1:].isdigit():
+            self.vk = 0x6F + int(name[1:])  # VK_F1 is 0x70
+        else:
+            self.vk = self._user32.VkKeyScanW(ord(name)) & 0xFF
+        self.callback = callback
+        self.thread_id = None
+        self._ready = threading.Event()
+
+    def run(self):
+        import ctypes
+        from ctypes import wintypes
+
+        self.thread_id = self._kernel32.GetCurrentThreadId()
+        registered = self._user32.RegisterHotKey(None, 1, 0x4000, self.vk)  # MOD_NOREPEAT
+        self._ready.set()
+        if not registered:
+            print(f"Could not register the trace hotkey (vk {self.vk:#x}), it is taken by another program")
+            return
+        msg = wintypes.MSG()
+        try:
+            while self._user32.GetMessageW(ctypes.byref(msg), None, 0, 0) > 0:
+                if msg.message == 0x0312:  # WM_HOTKEY
+                    self.callback()
+        finally:
+            self._user32.UnregisterHotKey(None, 1)
+
+    def stop(self):
+        self._ready.wait(timeout=1)
+        if self.thread_id is not None:
+            self._user32.PostThreadMessageW(self.thread_id, 0x0012, 0, 0)  # WM_QUIT
+        self.join(timeout=1)
+
+
+def hotkey_listener(name, callback):
+    """Started listener calling `callback` whenever the key `name` ("f8", "p", ...) is pressed
+
+    On Windows this is a WindowsHotkey: pynput's listener there is a global
+    low-level hook, and every keystroke, the bot's own included, would wait
+    for its Python callback. Elsewhere pynput only observes keys.
+    """
+    if sys.platform == "win32":
+        listener = WindowsHotkey(name, callback)
+        listener.start()
+        return listener
+
+    from pynput import keyboard
+
+    target = keyboard.Key[name] if name in keyboard.Key.__members__ else keyboard.KeyCode.from_char(name)
+
+    def on_press(key):
+        if key == target:
+            callback()
+
+    listener = keyboard.Listener(on_press=on_press)
+    listener.start()
+    return listener
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert an event trace dump to Chrome / Perfetto trace JSON")
+    parser.add_argument("trace", help=".bin dump written by the bot")
+    parser.add_argument("--output", help="JSON path (default: next to the dump)")
+    args = parser.parse_args()
+    output, count = convert_trace(args.trace, args.output)
+    print(f"{count} records written to {output}")
+
+
+if __name__ == "__main__":
+    main()
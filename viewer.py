@@ -0,0 +1,162 @@
+"""Debug vision window in its own process, fed through shared memory"""
+
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Header fields (int64)
+SEQ, QUIT, FRAMES, TIMESTAMP = range(4)
+# Live numbers (float64)
+NUMBERS = ("fps", "e2e_p50_us", "e2e_p99_us", "classify_p50_us", "classify_p99_us")
+
+
+def _layout(shape, lanes):
+    """(name, dtype, shape) of every array in the shared block, in order"""
+    height, width = shape[:2]
+    return (
+        ("header", np.int64, (4,)),
+        ("numbers", np.float64, (len(NUMBERS),)),
+        ("pressed", np.uint8, (lanes,)),
+        ("frame", np.uint8, (height, width, 4)),
+        ("mask", np.uint8, (height, width)),
+    )
+
+
+def _views(buf, shape, lanes):
+    views = {}
+    offset = 0
+    for name, dtype, dims in _layout(shape, lanes):
+        views[name] = np.ndarray(dims, dtype=dtype, buffer=buf, offset=offset)
+        # Keep every array 8 byte aligned
+        offset += -(-views[name].nbytes // 8) * 8
+    return views
+
+
+def _size(shape, lanes):
+    return sum(-(-int(np.prod(dims)) * np.dtype(dtype).itemsize // 8) * 8 for _, dtype, dims in _layout(shape, lanes))
+
+
+class DebugViewer:
+    """Publishes the latest frame, class mask, pressed keys and latencies for the viewer process
+
+    The detection loop calls publish() every frame; it returns at once unless
+    1/fps seconds have passed since the last copy, so the loop only pays for
+    a clock read most frames and a frame copy a few dozen times a second.
+    Only the mask rows the bot writes (Bot.mask_start on) are copied, the
+    hit band alone in reactive mode.
+    Writes are guarded by a sequence number (odd while writing) so the viewer
+    never draws a half-written frame.
+    """
+
+    def __init__(self, shape, lanes, lane_width, hit_line, band_start, fps=30):
+        self.shape = shape
+        self.lanes = lanes
+        self.interval = int(1e9 / fps)
+        self._shm = shared_memory.SharedMemory(create=True, size=_size(shape, lanes))
+        self._views = _views(self._shm.buf, shape, lanes)
+        self._header = self._views["header"]
+        self._header[:] = 0
+        self._views["mask"][:] = 0
+        self._args = (self._shm.name, shape, lanes, lane_width, hit_line, band_start, fps)
+        self._process = None
+        self._next = 0
+        self.frames = 0
+        self._last_frames = 0
+        self._last_time = time.perf_counter_ns()
+
+    def start(self):
+        self._process = multiprocessing.Process(target=run_viewer, args=self._args, name="viewer", daemon=True)
+        self._process.start()
+
+    def publish(self, img, timestamp, bot):
+        """Share this frame if the refresh interval has passed, returns True once the viewer asked to quit"""
+        self.frames += 1
+        now = time.perf_counter_ns()
+        if now < self._next:
+            return False
+        self._next = now + self.interval
+        views = self._views
+        header = self._header
+        header[SEQ] += 1
+        views["frame"][:] = img
+        start = bot.mask_start
+        views["mask"][start:] = bot.color_mask[start:]
+        views["pressed"][:] = bot.keys_down()
+        numbers = views["numbers"]
+        numbers[0] = (self.frames - self._last_frames) / ((now - self._last_time) / 1e9)
+        if bot.stats is not None:
+            numbers[1] = bot.stats.end_to_end.percentile(50) / 1000
+            numbers[2] = bot.stats.end_to_end.percentile(99) / 1000
+            numbers[3] = bot.stats.classify.percentile(50) / 1000
+            numbers[4] = bot.stats.classify.percentile(99) / 1000
+        header[FRAMES] = self.frames
+        header[TIMESTAMP] = timestamp
+        header[SEQ] += 1
+        self._last_frames = self.frames
+        self._last_time = now
+        return bool(header[QUIT])
+
+    def close(self):
+        self._header[QUIT] = 1
+        if self._process is not None:
+            self._process.join(timeout=1)
+            if self._process.is_alive():
+                self._process.terminate()
+        self._views = self._header = None
+        self._shm.close()
+        self._shm.unlink()
+
+
+def run_viewer(name, shape, lanes, lane_width, hit_line, band_start, fps):
+    """Viewer process: redraw the shared frame at most `fps` times a second until told to quit"""
+    import cv2
+
+    shm = shared_memory.SharedMemory(name=name)
+    views = _views(shm.buf, shape, lanes)
+    header = views["header"]
+    height, width = shape[:2]
+    frame = np.empty((height, width, 4), dtype=np.uint8)
+    mask = np.empty((height, width), dtype=np.uint8)
+    pressed = np.empty(lanes, dtype=np.uint8)
+    numbers = np.empty(len(NUMBERS))
+    last_seq = 0
+    try:
+        while not header[QUIT]:
+            time.sleep(1 / fps)
+            seq = int(header[SEQ])
+            if seq == last_seq or seq % 2:
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    header[QUIT] = 1
+                continue
+            frame[:] = views["frame"]
+            mask[:] = views["mask"]
+            pressed[:] = views["pressed"]
+            numbers[:] = views["numbers"]
+            if int(header[SEQ]) != seq:
+                continue
+            last_seq = seq
+
+            display = frame[:, :, :3].copy()
+            display[mask > 0] = display[mask > 0] // 2 + np.array((0, 127, 0), dtype=np.uint8)
+            cv2.line(display, (0, band_start), (width, band_start), (0, 200, 255), 1)
+            cv2.line(display, (0, hit_line), (width, hit_line), (0, 0, 255), 3)
+            for j in range(lanes):
+                cv2.line(display, (j * lane_width, 0), (j * lane_width, height), (0, 255, 0), 2)
+                color = (0, 255, 255) if pressed[j] else (80, 80, 80)
+                cv2.rectangle(display, (j * lane_width + 4, height - 14), ((j + 1) * lane_width - 4, height - 4),
+                              color, -1)
+            lines = [f"{numbers[0]:.0f} fps  frame #{int(header[FRAMES])}"]
+            if numbers[1]:
+                lines.append(f"e2e p50 {numbers[1]:.0f}us p99 {numbers[2]:.0f}us")
+                lines.append(f"classify p50 {numbers[3]:.0f}us p99 {numbers[4]:.0f}us")
+            for i, text in enumerate(lines):
+                cv2.putText(display, text, (6, 18 + 18 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+            cv2.imshow('Bot Vision', display)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                header[QUIT] = 1
+    finally:
+        cv2.destroyAllWindows()
+        views = header = None
+        shm.close()